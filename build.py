@@ -1,77 +1,479 @@
 #!/usr/bin/env python3
 
-import os, sys, imp, subprocess, argparse
+import os, sys, imp, subprocess, argparse, multiprocessing, traceback, time, json
 
 import tools
+from tools.cache import BuildCache
+from tools.perf import PerfRecorder
+from tools import timing, utilization
 
-def main():
-	tools.print_header()
-	
-	parser = argparse.ArgumentParser(description="Build system and library for the RHINO platform and derivatives.")
-	parser.add_argument("-e", "--extension-dir", action="append", default=[os.getcwd()])
-	parser.add_argument("-p", "--platform", default="rhino")
-	parser.add_argument("applications", nargs="+")
-	args = parser.parse_args()
-	search_dirs = list(map(os.path.abspath, reversed(args.extension_dir)))
-	platform = args.platform
-	apps = args.applications
-
+# The backend defaults to the vendor of the platform
+def load_modules(search_dirs, platform, backend=None):
 	platform_module = tools.try_import(search_dirs, os.path.join("platform", platform), "platform")
-	builder_module = tools.try_import(search_dirs, "tools", platform_module.TARGET_VENDOR)
+	builder_module = tools.try_import(search_dirs, "tools", backend or platform_module.TARGET_VENDOR)
+	return platform_module, builder_module
 
-	library_hdl = tools.find_hdl_source_files(os.path.join(search_dir, "library", "hdl") for search_dir in search_dirs)
+def find_library_hdl(search_dirs):
+	return tools.find_hdl_source_files(os.path.join(search_dir, "library", "hdl") for search_dir in search_dirs)
 
-	# Build each application
-	for build_name in apps:
-		print(" Building '%s'..." % build_name)
-		
-		# Prepare environment
-		root_dir, application_dir = tools.find_dir(search_dirs, os.path.join("application", build_name))
-		if application_dir is None:
-			raise IOError("Could not find application " + build_name)
-		build_dir = os.path.join(application_dir, "build")
-		output_dir = os.path.join(application_dir, "output")
-		tools.mkdir_noerror(build_dir)
-		tools.mkdir_noerror(output_dir)
-		sys.path.insert(0, root_dir)
-		
+# Override parameters of the components of an application.
+# overrides maps a component name, or a component class name (in lower case,
+# matching all its instances), to the parameters to change.
+def apply_overrides(components, overrides):
+	# imported here, the library is found through the search directories
+	from library.baseapp import Comp
+	r = []
+	for c in components:
+		if not isinstance(c, Comp):
+			c = Comp(c)
+		params = dict(c.comp_params)
+		for key in [c.comp_class.__name__.lower(), c.name]:
+			if key in overrides:
+				params.update(overrides[key])
+		r.append(Comp(c.comp_class, c.name, **params))
+	return r
+
+# Name of the files of a build, <application>_<variant> for variants
+def output_name(build_name, variant=None):
+	if variant is None:
+		return build_name
+	return build_name + "_" + variant
+
+# timing_gate: keyword arguments of tools.timing.check, or None
+# elaborate_only: stop after writing the Verilog and symbol table
+# overrides, variant: build a variant of the application with the given
+# component parameter overrides (see apply_overrides)
+def build_application(search_dirs, platform_module, builder_module, library_hdl, build_name,
+  cache=None, builder_options={}, timing_gate=None, elaborate_only=False, overrides=None, variant=None):
+	output = output_name(build_name, variant)
+	print(" Building '%s'..." % output)
+
+	# Prepare environment
+	root_dir, application_dir = tools.find_dir(search_dirs, os.path.join("application", build_name))
+	if application_dir is None:
+		raise IOError("Could not find application " + build_name)
+	build_dir = os.path.join(application_dir, "build")
+	output_dir = os.path.join(application_dir, "output")
+	tools.mkdir_noerror(build_dir)
+	tools.mkdir_noerror(output_dir)
+	sys.path.insert(0, root_dir)
+	orig_dir = os.getcwd()
+
+	perf = PerfRecorder()
+
+	try:
 		# Build application and generate sources
-		application_module = imp.load_source(build_name, os.path.join(application_dir, "top.py"))
-		app = platform_module.BaseApp(application_module.COMPONENTS)
-		generated_hdl_src, namespace, sig_constraints, platform_commands, symtab_src = app.get_source()
-		
+		with perf.phase("elaboration"):
+			application_module = imp.load_source(build_name, os.path.join(application_dir, "top.py"))
+			components = application_module.COMPONENTS
+			if overrides:
+				components = apply_overrides(components, overrides)
+			app = platform_module.BaseApp(components,
+				**getattr(application_module, "BASEAPP_OPTIONS", dict()))
+		module_dir = builder_options.get("module_dir")
+		hierarchical = builder_options.get("keep_hierarchy", False) or module_dir is not None
+		generated_hdl_src, namespace, sig_constraints, platform_commands, symtab_src = \
+			app.get_source(perf, hierarchical=hierarchical, reuse_modules=module_dir is not None)
+
 		# Write sources to filesystem
-		generated_hdl_file = os.path.join(build_dir, build_name + ".v")
+		generated_hdl_file = os.path.join(build_dir, output + ".v")
 		tools.write_to_file(generated_hdl_file, generated_hdl_src)
-		tools.write_to_file(os.path.join(build_dir, build_name + ".symtab"), symtab_src)
+		tools.write_to_file(os.path.join(build_dir, output + ".symtab"), symtab_src)
+		# depth, width and paging of the memories, for the host package
+		tools.write_to_file(os.path.join(build_dir, output + ".memories.json"),
+			json.dumps(app.memory_map, indent=1, sort_keys=True))
+		if elaborate_only:
+			print(" Elaborated '%s'" % output)
+			return
 
 		# Build list of HDL sources
-		application_hdl = [{"type":"verilog", "path":os.path.join(application_dir, "build", generated_hdl_file)}]
+		application_hdl = [{"type":"verilog", "path":os.path.join(application_dir, "build", generated_hdl_file),
+			"generated":True}]
+		if module_dir is not None:
+			application_hdl += _write_modules(module_dir, app.module_sources)
 		application_hdl += tools.find_hdl_source_files([os.path.join(application_dir, "hdl")])
 		application_hdl += library_hdl
-	
-		# Synthesize project
-		orig_dir = os.getcwd()
-		os.chdir(os.path.join(application_dir, "build"))
-		bitstream = builder_module.build(platform_module.TARGET_DEVICE,
-			application_hdl,
-			namespace, sig_constraints, platform_commands,
-			build_name)
-		os.chdir(orig_dir)
 
-		# Create BOF file
-		r = subprocess.call(["mkbof",
-			"-t", str(platform_module.MKBOF_HWRTYP),
-			"-s", os.path.join(build_dir, build_name + ".symtab"),
-			"-o", os.path.join(output_dir, build_name + ".bof"),
-			os.path.join(build_dir, build_name + ".bin")])
-		if r != 0:
-			raise OSError("Subprocess failed")
-		
+		# Look up the build cache
+		timing_file = os.path.join(build_dir, output + ".timing.json")
+		util_file = os.path.join(build_dir, output + ".util.json")
+		artifacts = {
+			"design.bin": os.path.join(build_dir, output + ".bin"),
+			"design.bof": os.path.join(output_dir, output + ".bof")
+		}
+		optional_artifacts = {
+			"timing.json": timing_file,
+			"util.json": util_file
+		}
+		cache_key = None
+		cache_hit = False
+		if cache is not None:
+			build_id = builder_module.get_build_id(platform_module.TARGET_DEVICE,
+				namespace, sig_constraints, platform_commands)
+			cache_key = cache.key([generated_hdl_src, symtab_src, build_id, str(platform_module.MKBOF_HWRTYP),
+				repr(sorted(builder_options.items()))],
+				[s["path"] for s in application_hdl[1:]])
+			cache_hit = cache.fetch(cache_key, artifacts, optional_artifacts)
+
+		if cache_hit:
+			print(" Build cache hit for '%s' (%s)" % (output, cache_key[:12]))
+		else:
+			for f in optional_artifacts.values():
+				if os.path.exists(f):
+					os.remove(f)
+
+			# Synthesize project
+			os.chdir(os.path.join(application_dir, "build"))
+			bitstream = builder_module.build(platform_module.TARGET_DEVICE,
+				application_hdl,
+				namespace, sig_constraints, platform_commands,
+				output, perf=perf, **builder_options)
+			os.chdir(orig_dir)
+
+			# Create BOF file
+			make_bof = getattr(builder_module, "make_bof", tools.make_bof)
+			make_bof(platform_module.MKBOF_HWRTYP,
+				os.path.join(build_dir, output + ".symtab"),
+				os.path.join(build_dir, output + ".bin"),
+				os.path.join(output_dir, output + ".bof"),
+				perf)
+
+			# Timing results by clock domain
+			if hasattr(builder_module, "get_timing_report"):
+				entries = builder_module.get_timing_report(os.path.join(build_dir, output))
+				timing.write_report(timing_file,
+					timing.summarize(entries, _get_timespecs(app, namespace)))
+
+			# Resource utilization by component
+			if hasattr(builder_module, "get_utilization_report"):
+				report = builder_module.get_utilization_report(os.path.join(build_dir, output))
+				utilization.write_report(util_file,
+					utilization.summarize(report, app.instance_counts if hierarchical else None))
+
+			if cache_key is not None:
+				cache.store(cache_key, dict(artifacts, **optional_artifacts))
+		_write_perf_report(perf, root_dir, build_dir, output, cache_hit)
+
+		if os.path.exists(util_file):
+			utilization.print_summary(utilization.read_report(util_file))
+		if os.path.exists(timing_file):
+			summary = timing.read_report(timing_file)
+			timing.print_summary(summary)
+			if timing_gate is not None:
+				problems = timing.check(summary, **timing_gate)
+				if problems:
+					raise timing.TimingError("Timing check of '%s' failed: %s" % (output, "; ".join(problems)))
+	finally:
 		# Clean up environment
+		os.chdir(orig_dir)
 		sys.path.remove(root_dir)
-		
-		print(" Completed build of '%s'" % build_name)
+
+	print(" Completed build of '%s'" % output)
+
+# Write component modules to the shared module directory.
+# Modules are named after their contents, so an existing file is never
+# rewritten; the rename makes the write atomic for parallel builds.
+def _write_modules(module_dir, module_sources):
+	tools.mkdir_noerror(os.path.dirname(module_dir))
+	tools.mkdir_noerror(module_dir)
+	r = []
+	for module_name, src in module_sources:
+		path = os.path.join(module_dir, module_name + ".v")
+		if not os.path.exists(path):
+			tmp = "%s.%d.tmp" % (path, os.getpid())
+			tools.write_to_file(tmp, src)
+			os.rename(tmp, path)
+		r.append({"type":"verilog", "path":path, "module":module_name})
+	return r
+
+# Map clock domains to TIMESPEC names
+def _get_timespecs(app, namespace):
+	r = dict()
+	for domain, ts in app.crg.get_timespecs().items():
+		if not isinstance(ts, str):
+			ts = "TS_" + namespace.get_name(ts).replace("/", "_")
+		r[domain] = ts
+	return r
+
+def _git_revision(directory):
+	try:
+		return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=directory,
+			stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+# Write build/<output name>.perf.json and print the summary
+def _write_perf_report(perf, root_dir, build_dir, build_name, cache_hit):
+	perf.write_json(os.path.join(build_dir, build_name + ".perf.json"),
+		application=build_name,
+		revision=_git_revision(root_dir),
+		time=time.time(),
+		cache_hit=cache_hit)
+	perf.print_summary()
+
+# Watch mode
+# Modules of the library, platforms and applications are dropped before
+# each elaboration so that edits are picked up, while Migen and the rest of
+# the build system stay loaded.
+_WATCHED_PACKAGES = ["library", "platform", "application"]
+_WATCHED_EXTENSIONS = ["py", "v", "vh", "vo", "vhd", "vhdl", "vho"]
+
+def _is_watched_module(search_dirs, filename):
+	filename = os.path.abspath(filename)
+	for search_dir in search_dirs:
+		for package in _WATCHED_PACKAGES:
+			if filename.startswith(os.path.join(search_dir, package) + os.sep):
+				return True
+	return False
+
+def _watched_modules(search_dirs):
+	r = dict()
+	for name, module in list(sys.modules.items()):
+		filename = getattr(module, "__file__", None)
+		if filename and _is_watched_module(search_dirs, filename):
+			r[name] = os.path.abspath(filename)
+	return r
+
+def _watched_files(search_dirs, platform, apps):
+	dirs = []
+	files = []
+	for search_dir in search_dirs:
+		dirs.append(os.path.join(search_dir, "library"))
+		dirs.append(os.path.join(search_dir, "platform", platform))
+	for build_name in apps:
+		root_dir, application_dir = tools.find_dir(search_dirs, os.path.join("application", build_name))
+		if application_dir is not None:
+			files.append(os.path.join(application_dir, "top.py"))
+			dirs.append(os.path.join(application_dir, "hdl"))
+	for d in dirs:
+		for root, dirnames, filenames in os.walk(d):
+			dirnames[:] = [name for name in dirnames if name != "__pycache__"]
+			files += [os.path.join(root, name) for name in filenames
+				if name.rsplit(".")[-1] in _WATCHED_EXTENSIONS]
+	r = dict()
+	for f in files:
+		try:
+			r[os.path.abspath(f)] = os.stat(f).st_mtime
+		except OSError:
+			pass
+	return r
+
+def watch(search_dirs, platform, backend, apps, cache, builder_options, timing_gate, implement, interval):
+	library_hdl = find_library_hdl(search_dirs)
+	dependencies = dict()
+
+	def run(build_name):
+		for name in _watched_modules(search_dirs):
+			del sys.modules[name]
+		start = time.time()
+		try:
+			platform_module, builder_module = load_modules(search_dirs, platform, backend)
+			build_application(search_dirs, platform_module, builder_module, library_hdl, build_name,
+				cache, builder_options, timing_gate, elaborate_only=not implement)
+		except Exception:
+			traceback.print_exc()
+		dependencies[build_name] = set(_watched_modules(search_dirs).values())
+		print(" '%s' processed in %.2fs" % (build_name, time.time() - start))
+
+	for build_name in apps:
+		run(build_name)
+	state = _watched_files(search_dirs, platform, apps)
+	print(" Watching for changes (Ctrl-C to stop)...")
+	try:
+		while True:
+			time.sleep(interval)
+			new_state = _watched_files(search_dirs, platform, apps)
+			changed = set(f for f in set(state) | set(new_state) if state.get(f) != new_state.get(f))
+			state = new_state
+			if not changed:
+				continue
+
+			affected = set()
+			for f in changed:
+				if f.endswith(".py"):
+					users = [build_name for build_name in apps if f in dependencies.get(build_name, ())]
+					# a new module may be used by any application
+					affected |= set(users or apps)
+				elif implement:
+					# HDL sources only matter to the vendor tools
+					library_hdl = find_library_hdl(search_dirs)
+					affected |= set(apps)
+			for build_name in apps:
+				if build_name in affected:
+					run(build_name)
+	except KeyboardInterrupt:
+		pass
+
+# Memory available for new processes, in bytes (None if unknown)
+def available_memory():
+	try:
+		with open("/proc/meminfo") as f:
+			for line in f:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1])*1024
+	except IOError:
+		pass
+	return None
+
+def max_jobs(requested, mem_per_job):
+	jobs = max(1, requested)
+	avail = available_memory()
+	if avail is not None:
+		jobs = min(jobs, max(1, avail//(mem_per_job*1024*1024)))
+	return jobs
+
+# Runs in a worker process of its own, so that the global state changed by
+# build_application (sys.path, working directory, loaded modules) is never
+# shared between applications. All output, including that of the vendor
+# tools, goes to build/<output name>.log.
+def _build_worker(job):
+	search_dirs, platform, backend, library_hdl, cache_dir, builder_options, timing_gate, target = job
+	build_name, overrides, variant = target
+	output = output_name(build_name, variant)
+	start = time.time()
+	root_dir, application_dir = tools.find_dir(search_dirs, os.path.join("application", build_name))
+	if application_dir is None:
+		return output, None, "Could not find application " + build_name, time.time() - start
+	build_dir = os.path.join(application_dir, "build")
+	tools.mkdir_noerror(build_dir)
+	log_file = os.path.join(build_dir, output + ".log")
+
+	log = open(log_file, "w")
+	sys.stdout.flush()
+	sys.stderr.flush()
+	os.dup2(log.fileno(), 1)
+	os.dup2(log.fileno(), 2)
+	error = None
+	try:
+		platform_module, builder_module = load_modules(search_dirs, platform, backend)
+		cache = BuildCache(cache_dir) if cache_dir else None
+		build_application(search_dirs, platform_module, builder_module, library_hdl, build_name,
+			cache, builder_options, timing_gate, overrides=overrides, variant=variant)
+	except BaseException as e:
+		traceback.print_exc()
+		error = "%s: %s" % (type(e).__name__, e)
+	sys.stdout.flush()
+	sys.stderr.flush()
+	log.close()
+	return output, log_file, error, time.time() - start
+
+def _format_duration(seconds):
+	m, s = divmod(int(seconds), 60)
+	return "%dm%02ds" % (m, s)
+
+# targets: list of (application, overrides, variant), see build_application
+# Returns the list of (output name, log file, error, duration).
+def build_parallel(search_dirs, platform, backend, library_hdl, cache_dir, builder_options, timing_gate,
+  targets, jobs):
+	print(" Building %d application(s) with %d job(s)..." % (len(targets), jobs))
+	work = [(search_dirs, platform, backend, library_hdl, cache_dir, builder_options, timing_gate, target)
+		for target in targets]
+	results = []
+	pool = multiprocessing.Pool(jobs, maxtasksperchild=1)
+	try:
+		for result in pool.imap_unordered(_build_worker, work):
+			build_name, log_file, error, duration = result
+			print(" %s '%s' (%s)" % ("Failed" if error else "Completed", build_name, _format_duration(duration)))
+			results.append(result)
+	finally:
+		pool.close()
+		pool.join()
+
+	print("")
+	print(" Summary:")
+	width = max(len(build_name) for build_name, log_file, error, duration in results)
+	for build_name, log_file, error, duration in sorted(results):
+		print("  %-*s  %-6s  %8s  %s" % (width, build_name, "FAILED" if error else "OK",
+			_format_duration(duration), log_file or ""))
+		if error:
+			print("  %-*s  %s" % (width, "", error))
+	return results
+
+# "1-4,8" -> [1, 2, 3, 4, 8]
+def parse_int_list(s):
+	r = []
+	for part in s.split(","):
+		if "-" in part:
+			first, last = part.split("-")
+			r += list(range(int(first), int(last) + 1))
+		else:
+			r.append(int(part))
+	return r
+
+def main():
+	tools.print_header()
+
+	parser = argparse.ArgumentParser(description="Build system and library for the RHINO platform and derivatives.")
+	parser.add_argument("-e", "--extension-dir", action="append", default=[os.getcwd()])
+	parser.add_argument("-p", "--platform", default="rhino")
+	parser.add_argument("-b", "--backend",
+		help="module of tools/ implementing the build (default: vendor of the platform, "
+		"'null' stops before invoking any tool)")
+	parser.add_argument("-j", "--jobs", type=int, default=1,
+		help="number of applications to build in parallel")
+	parser.add_argument("--mem-per-job", type=int, default=3072,
+		help="memory (MB) reserved for each parallel job, caps the number of jobs")
+	parser.add_argument("--cache-dir", default=os.path.join(os.path.expanduser("~"), ".cache", "rhino-tools"),
+		help="directory of the build cache")
+	parser.add_argument("--no-cache", action="store_true",
+		help="always run the vendor tools")
+	parser.add_argument("--cost-tables", type=parse_int_list,
+		help="placer cost tables to explore in parallel, e.g. 1-8 (Xilinx)")
+	parser.add_argument("--hierarchical", action="store_true",
+		help="emit each component as a module of its own and report its resource utilization")
+	parser.add_argument("--reuse-modules", action="store_true",
+		help="synthesize each component module separately and share the netlists "
+		"between builds and applications (Xilinx)")
+	parser.add_argument("--timing-fail", action="store_true",
+		help="fail the build when timing constraints are not met")
+	parser.add_argument("--timing-baseline",
+		help="timing.json of a previous build, fail when a clock domain's worst slack got worse")
+	parser.add_argument("--timing-tolerance", type=float, default=0.0,
+		help="slack degradation (ns) tolerated against the baseline")
+	parser.add_argument("-w", "--watch", action="store_true",
+		help="stay running and elaborate applications again when their sources change")
+	parser.add_argument("--watch-implement", action="store_true",
+		help="in watch mode, also run the backend after each elaboration")
+	parser.add_argument("--watch-interval", type=float, default=0.5,
+		help="seconds between checks for changes in watch mode")
+	parser.add_argument("applications", nargs="+")
+	args = parser.parse_args()
+	search_dirs = list(map(os.path.abspath, reversed(args.extension_dir)))
+	platform = args.platform
+	apps = args.applications
+
+	library_hdl = find_library_hdl(search_dirs)
+	cache_dir = None if args.no_cache else args.cache_dir
+	builder_options = dict()
+	if args.cost_tables:
+		builder_options["cost_tables"] = args.cost_tables
+	if args.hierarchical:
+		builder_options["keep_hierarchy"] = True
+	if args.reuse_modules:
+		builder_options["module_dir"] = os.path.join(cache_dir or os.path.join(os.getcwd(), "build"), "modules")
+	timing_gate = None
+	if args.timing_fail or args.timing_baseline:
+		timing_gate = {
+			"fail_on_errors": args.timing_fail,
+			"baseline": timing.read_report(args.timing_baseline) if args.timing_baseline else None,
+			"tolerance": args.timing_tolerance
+		}
+
+	jobs = min(max_jobs(args.jobs, args.mem_per_job), len(apps))
+	if args.watch:
+		watch(search_dirs, platform, args.backend, apps, BuildCache(cache_dir) if cache_dir else None,
+			builder_options, timing_gate, args.watch_implement, args.watch_interval)
+	elif jobs > 1:
+		results = build_parallel(search_dirs, platform, args.backend, library_hdl, cache_dir, builder_options, timing_gate,
+			[(build_name, None, None) for build_name in apps], jobs)
+		if any(error for build_name, log_file, error, duration in results):
+			sys.exit(1)
+	else:
+		platform_module, builder_module = load_modules(search_dirs, platform, args.backend)
+		cache = BuildCache(cache_dir) if cache_dir else None
+		for build_name in apps:
+			build_application(search_dirs, platform_module, builder_module, library_hdl, build_name,
+				cache, builder_options, timing_gate)
 
 if __name__ == "__main__":
 	main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# Throughput of the host stream API against stand-in devices: a named pipe
+# fed by a thread for the stream to the host, and one drained by a thread
+# for the stream from the host. Both streams are serviced by one asyncio
+# event loop.
+# $ python3 -m host.bench_streams --size 512
+
+import os, time, tempfile, threading, asyncio, argparse
+
+from host.stream import StreamReader, StreamWriter, AsyncStreamReader, AsyncStreamWriter
+
+def _feed(path, nbytes, chunk):
+	# opened read-write, so that the host side finds a writer when it opens
+	fd = os.open(path, os.O_RDWR)
+	data = bytes(chunk)
+	sent = 0
+	while sent < nbytes:
+		sent += os.write(fd, data[:min(chunk, nbytes - sent)])
+	os.close(fd)
+
+def _drain(path, nbytes, chunk, opened):
+	fd = os.open(path, os.O_RDWR)
+	opened.set()
+	received = 0
+	while received < nbytes:
+		received += len(os.read(fd, chunk))
+	os.close(fd)
+
+async def _capture(reader):
+	areader = AsyncStreamReader(reader)
+	start = time.time()
+	total = 0
+	while True:
+		block = await areader.read_block()
+		if block is None:
+			break
+		total += block.nbytes
+		reader.release_block()
+	return total, time.time() - start
+
+async def _playback(writer, nbytes):
+	awriter = AsyncStreamWriter(writer)
+	start = time.time()
+	total = 0
+	while total < nbytes:
+		block = await awriter.get_block()
+		block[:] = total & 0xffff
+		await awriter.write_block()
+		total += block.nbytes
+	await awriter.drain()
+	return total, time.time() - start
+
+async def _run(reader, writer, nbytes):
+	return await asyncio.gather(_capture(reader), _playback(writer, nbytes))
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark host streams against named pipes.")
+	parser.add_argument("--size", type=int, default=256, help="MB to transfer in each direction")
+	parser.add_argument("--block-words", type=int, default=4096)
+	parser.add_argument("--blocks", type=int, default=2)
+	args = parser.parse_args()
+	nbytes = args.size*1024*1024
+	chunk = 2*args.block_words
+
+	directory = tempfile.mkdtemp()
+	path_out = os.path.join(directory, "affine_out")
+	path_in = os.path.join(directory, "affine_in")
+	os.mkfifo(path_out)
+	os.mkfifo(path_in)
+	try:
+		opened = threading.Event()
+		threads = [threading.Thread(target=_feed, args=(path_out, nbytes, chunk)),
+			threading.Thread(target=_drain, args=(path_in, nbytes, chunk, opened))]
+		for t in threads:
+			t.daemon = True
+			t.start()
+		opened.wait()
+		# the feeder opens its end without waiting for a reader
+		while True:
+			reader = StreamReader(path_out, args.block_words, args.blocks)
+			if reader.fill() or not reader.eof:
+				break
+			reader.close()
+			time.sleep(0.01)
+		writer = StreamWriter(path_in, args.block_words, args.blocks)
+
+		(received, t_in), (sent, t_out) = asyncio.run(_run(reader, writer, nbytes))
+		reader.close()
+		writer.close()
+		for t in threads:
+			t.join()
+	finally:
+		os.unlink(path_out)
+		os.unlink(path_in)
+		os.rmdir(directory)
+
+	print("  %-12s %10s %10s %10s" % ("Stream", "MB", "Time (s)", "MB/s"))
+	for name, n, t in [("to host", received, t_in), ("from host", sent, t_out)]:
+		print("  %-12s %10.1f %10.2f %10.1f" % (name, n/1048576, t, n/1048576/t))
+
+if __name__ == "__main__":
+	main()
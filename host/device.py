@@ -0,0 +1,249 @@
+import os, mmap
+
+import numpy as np
+
+from host import symtab
+
+# Address range of the CSR window of a symbol table
+def _csr_window(symbols):
+	end = max(s.address + s.length for s in symbols if symtab.is_csr(s))
+	return symtab.CSR_BASE, end
+
+# Map length bytes at offset of a file, as 16-bit words
+def _map_words(filename, offset, length):
+	fd = os.open(filename, os.O_RDWR | getattr(os, "O_SYNC", 0))
+	try:
+		aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+		m = mmap.mmap(fd, length + offset - aligned, offset=aligned)
+	finally:
+		os.close(fd)
+	words = np.frombuffer(m, dtype=np.uint16, count=length//symtab.WORD_SIZE, offset=offset - aligned)
+	return m, words
+
+# Create a file standing in for the hardware, for use as
+# Device(symtab_file, filename, base=symtab.CSR_BASE)
+def create_backing_file(symtab_file, filename):
+	start, end = _csr_window(symtab.read(symtab_file))
+	with open(filename, "wb") as f:
+		f.truncate(end - start)
+
+# Words are accessed in address order, so the hardware sees the most
+# significant one first. A 32-bit atomic register is accessed with a single
+# 32-bit load or store, split by the GPMC into two word accesses starting
+# with the lower address.
+class Register:
+	def __init__(self, symbol, words):
+		self.symbol = symbol
+		# 16-bit words of the register, most significant first
+		self.words = words
+		if symbol.perm & symtab.PERM_ATOMIC and len(words) == 2:
+			self._word32 = words.view(np.uint32)
+		else:
+			self._word32 = None
+	
+	# Drop the views of the mapping when the device is closed
+	def release(self):
+		self.words = None
+		self._word32 = None
+	
+	def _check_open(self):
+		if self.words is None:
+			raise IOError("Register %s belongs to a closed device" % self.symbol.name)
+	
+	def read(self):
+		self._check_open()
+		if not self.symbol.perm & symtab.PERM_READ:
+			raise IOError("Register %s is not readable" % self.symbol.name)
+		if self._word32 is not None:
+			v = int(self._word32[0])
+			return ((v & 0xffff) << 16) | (v >> 16)
+		value = 0
+		for w in self.words.tolist():
+			value = (value << 16) | w
+		return value
+	
+	def write(self, value):
+		self._check_open()
+		if not self.symbol.perm & symtab.PERM_WRITE:
+			raise IOError("Register %s is not writable" % self.symbol.name)
+		if self._word32 is not None:
+			self._word32[0] = ((value & 0xffff) << 16) | ((value >> 16) & 0xffff)
+			return
+		n = len(self.words)
+		self.words[:] = [(value >> 16*(n - 1 - i)) & 0xffff for i in range(n)]
+
+# A memory exposed through a CSR window. Reads and writes copy whole NumPy
+# arrays, of uint16, uint32 or uint64 depending on the width. Entries wider
+# than a word take a power of two number of words, most significant first.
+# Paged memories are copied a window at a time, selecting each one with the
+# page register.
+class MemoryWindow:
+	def __init__(self, symbol, words, depth=None, width=16, page=None):
+		self.symbol = symbol
+		self.page = page
+		self.nwords = (width + 15)//16
+		if self.nwords > 4:
+			raise NotImplementedError("Memory %s is wider than 64 bits" % symbol.name)
+		self.dtype = [np.uint16, np.uint32, np.uint64, np.uint64][self.nwords - 1]
+		stride = 1
+		while stride < self.nwords:
+			stride *= 2
+		# one row of words per entry of the window
+		self.words = words.reshape(-1, stride)
+		if depth is None:
+			depth = len(self.words)
+		self.depth = depth
+	
+	def __len__(self):
+		return self.depth
+	
+	def release(self):
+		self.words = None
+	
+	def _check_open(self):
+		if self.words is None:
+			raise IOError("Memory %s belongs to a closed device" % self.symbol.name)
+	
+	# (page, offset in the window, offset in the data, count) of the
+	# windows covering count entries at start
+	def _chunks(self, start, count):
+		window = len(self.words)
+		done = 0
+		while done < count:
+			page, offset = divmod(start + done, window)
+			n = min(window - offset, count - done)
+			yield page, offset, done, n
+			done += n
+	
+	def _select(self, page):
+		if self.page is not None:
+			self.page.write(page)
+	
+	def _shift(self, i):
+		return self.dtype(16*(self.nwords - 1 - i))
+	
+	def read(self, start=0, count=None):
+		self._check_open()
+		if count is None:
+			count = self.depth - start
+		if start + count > self.depth:
+			raise IndexError("%d entries at %d are out of %s" % (count, start, self.symbol.name))
+		data = np.zeros(count, dtype=self.dtype)
+		for page, offset, done, n in self._chunks(start, count):
+			self._select(page)
+			rows = self.words[offset:offset+n]
+			for i in range(self.nwords):
+				data[done:done+n] |= rows[:, i].astype(self.dtype) << self._shift(i)
+		return data
+	
+	# Signed data is stored in two's complement. The words of each entry are
+	# written in address order, the hardware writes the entry with the last.
+	def write(self, data, start=0):
+		self._check_open()
+		data = np.asarray(data).astype(self.dtype, copy=False)
+		if start + len(data) > self.depth:
+			raise IndexError("%d entries at %d do not fit in %s" % (len(data), start, self.symbol.name))
+		for page, offset, done, n in self._chunks(start, len(data)):
+			self._select(page)
+			rows = np.empty((n, self.nwords), dtype=np.uint16)
+			for i in range(self.nwords):
+				rows[:, i] = (data[done:done+n] >> self._shift(i)) & self.dtype(0xffff)
+			self.words[offset:offset+n, :self.nwords] = rows
+
+# Registers of a component as attributes: reading one returns its value,
+# assigning writes it. Memories are MemoryWindow attributes.
+class Component:
+	def __init__(self, name, registers, memories):
+		self.__dict__["name"] = name
+		self.__dict__["registers"] = registers
+		self.__dict__["memories"] = memories
+	
+	def __getattr__(self, name):
+		if name in self.registers:
+			return self.registers[name].read()
+		if name in self.memories:
+			return self.memories[name]
+		raise AttributeError("Component %s has no register %s" % (self.name, name))
+	
+	def __setattr__(self, name, value):
+		if name not in self.registers:
+			raise AttributeError("Component %s has no register %s" % (self.name, name))
+		self.registers[name].write(value)
+	
+	def __dir__(self):
+		return sorted(list(self.registers) + list(self.memories))
+
+# Registers and memories of a design, from the symbol table written by
+# build.py. The CSR window is mapped once from mem_file, where the byte at
+# offset 0 has the physical address base (0 for /dev/mem). To work against
+# a file standing in for the hardware, see create_backing_file.
+# The depth, width and paging of the memories are read from the memory map
+# next to the symbol table (symtab.memory_map_file), when there is one.
+# Otherwise memories are taken as one word wide and as deep as their window.
+# Components are attributes, e.g. device.wg.i_mode = 1
+class Device:
+	def __init__(self, symtab_file, mem_file="/dev/mem", base=0, memory_map_file=None):
+		symbols = symtab.read(symtab_file)
+		if memory_map_file is None:
+			memory_map_file = symtab.memory_map_file(symtab_file)
+		if os.path.exists(memory_map_file):
+			memory_map = symtab.read_memory_map(memory_map_file)
+		else:
+			memory_map = dict()
+		self.streams = [s for s in symbols if symtab.is_stream(s)]
+		
+		start, end = _csr_window(symbols)
+		self._map, self._words = _map_words(mem_file, start - base, end - start)
+		self.components = dict()
+		for name, entries in symtab.group(symbols).items():
+			registers = dict()
+			memories = dict()
+			for short_name, s, memory in entries:
+				first = (s.address - start)//symtab.WORD_SIZE
+				words = self._words[first:first + s.length//symtab.WORD_SIZE]
+				if memory:
+					memories[short_name] = (s, words)
+				else:
+					registers[short_name] = Register(s, words)
+			for short_name, (s, words) in memories.items():
+				if s.name in memory_map:
+					info = memory_map[s.name]
+					page = None
+					if info["page"] is not None:
+						page = registers[info["page"][len(name) + 1:]]
+					memories[short_name] = MemoryWindow(s, words, info["depth"], info["width"], page)
+				else:
+					memories[short_name] = MemoryWindow(s, words)
+			self.components[name] = Component(name, registers, memories)
+	
+	def __getattr__(self, name):
+		try:
+			return self.__dict__["components"][name]
+		except KeyError:
+			raise AttributeError("No component %s" % name)
+	
+	def __dir__(self):
+		return sorted(self.components)
+	
+	# Registers and memory windows still referenced by the caller are
+	# invalidated. Arrays returned by MemoryWindow.read are copies, but views
+	# of the mapping taken from the words attributes keep it from being
+	# unmapped.
+	def close(self):
+		for component in self.components.values():
+			for r in component.registers.values():
+				r.release()
+			for m in component.memories.values():
+				m.release()
+		self.components = dict()
+		self._words = None
+		try:
+			self._map.close()
+		except BufferError:
+			raise IOError("Cannot unmap the device, arrays viewing its registers are still referenced")
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, type, value, traceback):
+		self.close()
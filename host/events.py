@@ -0,0 +1,73 @@
+import os, select, time
+
+# Interrupt line of the design (irq_resource of the base application) seen
+# by the host as a GPIO through sysfs. The line is high while an enabled
+# event is pending.
+class GPIOInterrupt:
+	def __init__(self, number, sysfs="/sys/class/gpio"):
+		path = os.path.join(sysfs, "gpio%d" % number)
+		if not os.path.exists(path):
+			with open(os.path.join(sysfs, "export"), "w") as f:
+				f.write(str(number))
+		with open(os.path.join(path, "direction"), "w") as f:
+			f.write("in")
+		with open(os.path.join(path, "edge"), "w") as f:
+			f.write("rising")
+		self._value = open(os.path.join(path, "value"), "rb", buffering=0)
+		self._poll = select.poll()
+		self._poll.register(self._value, select.POLLPRI | select.POLLERR)
+	
+	def level(self):
+		self._value.seek(0)
+		return self._value.read(1) == b"1"
+	
+	# Returns False on timeout (in seconds, None to wait forever)
+	def wait(self, timeout=None):
+		if self.level():
+			return True
+		if timeout is None:
+			ready = self._poll.poll()
+		else:
+			ready = self._poll.poll(int(timeout*1000))
+		return self.level() if ready else False
+	
+	def close(self):
+		self._poll.unregister(self._value)
+		self._value.close()
+
+# Wait until one of the events in mask of component (bits of its
+# ev_pending register, see EventManager in tools/mmgr.py) is pending.
+# Returns the pending events in mask after clearing them, or 0 on timeout.
+# Without irq, ev_pending is polled every poll_interval seconds. It is also
+# polled while the shared irq line is held high by events of other
+# components (e.g. level events, pending until their trigger falls).
+# The events in mask are only enabled during the wait.
+def wait_events(component, mask, irq=None, timeout=None, poll_interval=0.001):
+	if timeout is not None:
+		deadline = time.monotonic() + timeout
+	enable = component.ev_enable
+	if irq is not None:
+		component.ev_enable = enable | mask
+	try:
+		while True:
+			pending = component.ev_pending & mask
+			if pending:
+				component.ev_pending = pending
+				return pending
+			if timeout is None:
+				remaining = None
+			else:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return 0
+			if irq is None or irq.level():
+				if remaining is None:
+					time.sleep(poll_interval)
+				else:
+					time.sleep(min(poll_interval, remaining))
+			else:
+				# the line is shared by all components, check ours again
+				irq.wait(remaining)
+	finally:
+		if irq is not None:
+			component.ev_enable = enable
@@ -0,0 +1,218 @@
+import os, asyncio
+from collections import deque
+
+import numpy as np
+
+from host import symtab
+
+# Ring of bytes split into equal blocks. Positions are byte counts since
+# the start of the stream, blocks never wrap around the end of the array.
+class RingBuffer:
+	def __init__(self, block_size, blocks):
+		self.block_size = block_size
+		self.data = np.zeros(block_size*blocks, dtype=np.uint8)
+		self.read_pos = 0
+		self.write_pos = 0
+	
+	def available(self):
+		return self.write_pos - self.read_pos
+	
+	def free(self):
+		return len(self.data) - self.available()
+	
+	# Largest contiguous free area
+	def write_region(self):
+		start = self.write_pos % len(self.data)
+		return self.data[start:start + min(self.free(), len(self.data) - start)]
+	
+	# Largest contiguous area with data
+	def read_region(self):
+		start = self.read_pos % len(self.data)
+		return self.data[start:start + min(self.available(), len(self.data) - start)]
+	
+	def block_at(self, pos):
+		start = pos % len(self.data)
+		return self.data[start:start + self.block_size]
+
+def _open(path, flags):
+	fd = os.open(path, flags | os.O_NONBLOCK)
+	return open(fd, "rb" if flags == os.O_RDONLY else "wb", buffering=0)
+
+# Stream to the host (TO_EXT). Data goes straight from the device into the
+# ring with readinto, and is handed out block by block as NumPy views: with
+# two blocks, the device fills one while the other is processed.
+class StreamReader:
+	def __init__(self, path, block_words=4096, blocks=2, dtype=np.uint16):
+		self.file = _open(path, os.O_RDONLY)
+		self.dtype = np.dtype(dtype)
+		self.ring = RingBuffer(block_words*self.dtype.itemsize, blocks)
+		self.eof = False
+		# sizes of the blocks handed out
+		self._out = deque()
+	
+	def fileno(self):
+		return self.file.fileno()
+	
+	# Read what the device has, without blocking. Returns the number of bytes.
+	def fill(self):
+		region = self.ring.write_region()
+		if not len(region):
+			return 0
+		n = self.file.readinto(memoryview(region))
+		if n is None:
+			return 0
+		if n == 0:
+			self.eof = True
+		self.ring.write_pos += n
+		return n
+	
+	# Next full block not handed out yet (the last one may be partial at the
+	# end of the stream), or None. The view is valid until the block is
+	# released.
+	def read_block(self):
+		pos = self.ring.read_pos + sum(self._out)
+		n = min(self.ring.write_pos - pos, self.ring.block_size)
+		n -= n % self.dtype.itemsize
+		if n < self.ring.block_size and not (self.eof and n):
+			return None
+		self._out.append(n)
+		return self.ring.block_at(pos)[:n].view(self.dtype)
+	
+	# Give the oldest block handed out back to the device
+	def release_block(self):
+		self.ring.read_pos += self._out.popleft()
+	
+	def close(self):
+		self.file.close()
+
+# Stream from the host (FROM_EXT). Blocks are filled in place then written
+# to the device from the ring.
+class StreamWriter:
+	def __init__(self, path, block_words=4096, blocks=2, dtype=np.uint16):
+		self.file = _open(path, os.O_WRONLY)
+		self.dtype = np.dtype(dtype)
+		self.ring = RingBuffer(block_words*self.dtype.itemsize, blocks)
+		self._out = 0
+	
+	def fileno(self):
+		return self.file.fileno()
+	
+	# Next free block to fill, or None
+	def get_block(self):
+		pos = self.ring.write_pos + self._out*self.ring.block_size
+		if pos + self.ring.block_size - self.ring.read_pos > len(self.ring.data):
+			return None
+		self._out += 1
+		return self.ring.block_at(pos).view(self.dtype)
+	
+	# Queue the oldest block taken with get_block
+	def submit_block(self):
+		assert(self._out > 0)
+		self._out -= 1
+		self.ring.write_pos += self.ring.block_size
+	
+	# Write what the device accepts, without blocking. Returns the number of bytes.
+	def flush(self):
+		region = self.ring.read_region()
+		if not len(region):
+			return 0
+		n = self.file.write(memoryview(region))
+		if n is None:
+			return 0
+		self.ring.read_pos += n
+		return n
+	
+	def pending(self):
+		return self.ring.available()
+	
+	def close(self):
+		self.file.close()
+
+# asyncio front ends, so that one event loop services several streams.
+# They are created in a coroutine running in the loop, or given the loop.
+# Descriptors that cannot be polled (regular files standing in for the
+# device) are serviced from the default executor instead.
+class _AsyncStream:
+	def __init__(self, stream, loop):
+		self.stream = stream
+		if loop is None:
+			loop = asyncio.get_running_loop()
+		self.loop = loop
+		self._pollable = True
+		try:
+			self._watch(lambda: None)
+			self._unwatch()
+		except PermissionError:
+			self._pollable = False
+	
+	async def _wait_and(self, transfer):
+		if not self._pollable:
+			return await self.loop.run_in_executor(None, transfer)
+		ready = self.loop.create_future()
+		self._watch(lambda: ready.done() or ready.set_result(None))
+		try:
+			await ready
+		finally:
+			self._unwatch()
+		return transfer()
+
+class AsyncStreamReader(_AsyncStream):
+	def __init__(self, reader, loop=None):
+		_AsyncStream.__init__(self, reader, loop)
+	
+	def _watch(self, callback):
+		self.loop.add_reader(self.stream.fileno(), callback)
+	
+	def _unwatch(self):
+		self.loop.remove_reader(self.stream.fileno())
+	
+	# Next full block, None at the end of the stream. Call
+	# reader.release_block() when done with it.
+	async def read_block(self):
+		while True:
+			block = self.stream.read_block()
+			if block is not None or self.stream.eof:
+				return block
+			await self._wait_and(self.stream.fill)
+
+class AsyncStreamWriter(_AsyncStream):
+	def __init__(self, writer, loop=None):
+		_AsyncStream.__init__(self, writer, loop)
+	
+	def _watch(self, callback):
+		self.loop.add_writer(self.stream.fileno(), callback)
+	
+	def _unwatch(self):
+		self.loop.remove_writer(self.stream.fileno())
+	
+	# Next free block, waiting for the device to take queued data
+	async def get_block(self):
+		while True:
+			block = self.stream.get_block()
+			if block is not None:
+				return block
+			await self._wait_and(self.stream.flush)
+	
+	# Queue the block and start writing it
+	async def write_block(self):
+		self.stream.submit_block()
+		await self._wait_and(self.stream.flush)
+	
+	async def drain(self):
+		while self.stream.pending():
+			await self._wait_and(self.stream.flush)
+
+# Open the streams of a symbol table, as {name: StreamReader or StreamWriter}.
+# path_format gives the device of each stream from its name, e.g.
+# "/proc/<pid>/hw/ioreg/{name}" for a BORPH process.
+def open_streams(symtab_file, path_format, **options):
+	r = dict()
+	for s in symtab.read(symtab_file):
+		if not symtab.is_stream(s):
+			continue
+		path = path_format.format(name=s.name)
+		if s.perm & symtab.PERM_WRITE:
+			r[s.name] = StreamWriter(path, **options)
+		else:
+			r[s.name] = StreamReader(path, **options)
+	return r
@@ -0,0 +1,82 @@
+import re, json
+from collections import namedtuple
+
+# Must match library/baseapp.py and tools/mmgr.py
+CSR_BASE = 0x08000000
+CSR_BANK_SIZE = 0x400
+DMA_BASE = 0x10000000
+
+PERM_READ = 0x01
+PERM_WRITE = 0x02
+# Register latched on read and committed on write by the hardware, with a
+# 32-bit aligned address
+PERM_ATOMIC = 0x04
+
+# CSR words are 16-bit, registers wider than one word are stored most
+# significant word first
+WORD_SIZE = 2
+
+Symbol = namedtuple("Symbol", "name perm address length")
+
+_memory_re = re.compile(r"^(.*)_mem\d*$")
+
+# Parse the symbol table written by build.py (build/<application>.symtab)
+def parse(text):
+	symbols = []
+	for line in text.splitlines():
+		if not line.strip():
+			continue
+		name, perm, address, length = line.split("\t")
+		symbols.append(Symbol(name, int(perm), int(address, 0), int(length, 0)))
+	return symbols
+
+def read(filename):
+	with open(filename) as f:
+		return parse(f.read())
+
+def is_csr(symbol):
+	return CSR_BASE <= symbol.address < DMA_BASE
+
+def is_stream(symbol):
+	return symbol.address >= DMA_BASE
+
+# Memories are described in build/<application>.memories.json, written
+# next to the symbol table: {name: {"depth", "width", "page"}}, page being
+# the name of the register selecting the part of a memory deeper than its
+# bank that the bank shows (None if not paged).
+def memory_map_file(symtab_file):
+	return re.sub(r"\.symtab$", "", symtab_file) + ".memories.json"
+
+def read_memory_map(filename):
+	with open(filename) as f:
+		return json.load(f)
+
+# Group the CSR symbols by component.
+# Each component has a bank starting with its <name>_magic register, and
+# its memories are in the following banks as <name>_mem or <name>_mem<n>.
+# Returns {component: [(symbol name without the component prefix, symbol,
+# True for memories)]}.
+def group(symbols):
+	banks = dict()
+	for s in symbols:
+		if is_csr(s):
+			banks.setdefault((s.address - CSR_BASE)//CSR_BANK_SIZE, []).append(s)
+	components = dict()
+	for bank in sorted(banks):
+		memory = False
+		for s in banks[bank]:
+			if s.name.endswith("_magic"):
+				prefix = s.name[:-len("magic")]
+				break
+		else:
+			m = _memory_re.match(banks[bank][0].name)
+			if m is None or len(banks[bank]) != 1:
+				raise ValueError("Bank at 0x%08x has no magic register" % (CSR_BASE + bank*CSR_BANK_SIZE))
+			prefix = m.group(1) + "_"
+			memory = True
+		entries = components.setdefault(prefix[:-1], [])
+		for s in banks[bank]:
+			if not s.name.startswith(prefix):
+				raise ValueError("Symbol %s is not in component %s" % (s.name, prefix[:-1]))
+			entries.append((s.name[len(prefix):], s, memory))
+	return components
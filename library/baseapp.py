@@ -2,6 +2,8 @@ from migen.fhdl import verilog
 
 from tools.cmgr import *
 from tools.mmgr import *
+from tools.perf import PerfRecorder
+from tools import hierarchy
 from library.gpmc import *
 from library.crg import *
 
@@ -27,10 +29,13 @@ class GenericBaseApp:
 		
 		self.components = dict()
 		self.all_components = []
+		# (instance name, component), names are used for the hierarchy
+		self.named_components = []
 		
 		# clock and reset generator
 		self.crg = crg_factory(self)
 		self.all_components.append(self.crg)
+		self.named_components.append(("crg", self.crg))
 		
 		for c in components:
 			if not isinstance(c, Comp):
@@ -41,6 +46,25 @@ class GenericBaseApp:
 			if c.name is not None:
 				self.components[c.name] = inst
 			self.all_components.append(inst)
+			self.named_components.append((self._instance_name(c), inst))
+	
+	def _instance_name(self, comp):
+		if comp.name is not None:
+			return comp.name
+		used = set(name for name, inst in self.named_components)
+		base = comp.comp_class.__name__.lower()
+		n = 0
+		while base + str(n) in used:
+			n += 1
+		return base + str(n)
+	
+	# Logic of the platform (bus bridges, CSR banks...) without components
+	def get_base_fragment(self):
+		return Fragment()
+	
+	def get_fragment(self):
+		return self.get_base_fragment() + \
+			sum([c.get_fragment() for c in self.all_components], Fragment())
 	
 	def get_formatted_symtab(self):
 		symtab = self.get_symtab()
@@ -49,24 +73,63 @@ class GenericBaseApp:
 			r += "{}\t{}\t0x{:08x}\t0x{:x}\n".format(*s)
 		return r
 		
-	def get_source(self):
-		f = self.get_fragment()
-		symtab = self.get_formatted_symtab()
-		vsrc, ns = verilog.convert(f,
-			self.constraints.get_io_signals(),
-			clock_domains=self.crg.get_clock_domains(),
-			return_ns=True)
+	# In hierarchical mode, each component is emitted as a module of its own
+	# (instantiated under its instance name) so that the vendor tools can
+	# report on it.
+	# With reuse_modules, component modules are named after their contents
+	# and returned separately in self.module_sources as (module name, source),
+	# so that they can be compiled once for all instances and applications.
+	# The memories of the symbol table are described in self.memory_map.
+	def get_source(self, perf=None, hierarchical=False, reuse_modules=False):
+		if perf is None:
+			perf = PerfRecorder()
+		hierarchical = hierarchical or reuse_modules
+		if hierarchical:
+			with perf.phase("get_fragment"):
+				base = self.get_base_fragment()
+				fragments = [(name, c.get_fragment(), c.__class__.__name__.lower())
+					for name, c in self.named_components]
+			self.instance_counts = dict((name, hierarchy.count_instances(f)) for name, f, prefix in fragments)
+		else:
+			with perf.phase("get_fragment"):
+				f = self.get_fragment()
+		with perf.phase("symtab"):
+			symtab = self.get_formatted_symtab()
+			self.memory_map = self.get_memory_map()
+		with perf.phase("verilog.convert"):
+			if hierarchical:
+				vsrc, ns, modules = hierarchy.convert(base, fragments,
+					self.constraints.get_io_signals(),
+					self.crg.get_clock_domains(),
+					reuse=reuse_modules)
+				self.module_sources = []
+				for instance_name, module_name, src in modules:
+					if (module_name, src) not in self.module_sources:
+						self.module_sources.append((module_name, src))
+			else:
+				vsrc, ns = verilog.convert(f,
+					self.constraints.get_io_signals(),
+					clock_domains=self.crg.get_clock_domains(),
+					return_ns=True)
 		sig_constraints = self.constraints.get_sig_constraints()
 		platform_commands = self.constraints.get_platform_commands()
 		return vsrc, ns, sig_constraints, platform_commands, symtab
 
 class RhinoBaseApp(GenericBaseApp):
-	def __init__(self, components, platform_resources, crg_factory=lambda app: CRG100(app)):
-		self.csrs = CSRManager()
+	# gpmc_burst: synchronous burst accesses to the CSRs (see library/hdl/gpmc.v)
+	# csr_pipeline: pipeline depth of the CSR interconnect (see CSRManager)
+	# irq_resource: (name, number) of the resource driven by the interrupt
+	# line of the events (see EventManager), None to leave it unconnected
+	def __init__(self, components, platform_resources, crg_factory=lambda app: CRG100(app),
+	  gpmc_burst=False, csr_pipeline=0, irq_resource=None):
+		self.gpmc_burst = gpmc_burst
+		self.irq_resource = irq_resource
+		self.csrs = CSRManager(csr_pipeline)
+		self.events = EventManager()
 		self.streams = StreamManager(16)
 		GenericBaseApp.__init__(self, components, platform_resources, crg_factory)
 	
-	def get_fragment(self):
+	def get_base_fragment(self):
 		streams_from = self.streams.get_ports(FROM_EXT)
 		streams_to = self.streams.get_ports(TO_EXT)
 		s_count = len(streams_from) + len(streams_to)
@@ -75,13 +138,24 @@ class RhinoBaseApp(GenericBaseApp):
 			self.constraints.request("gpmc_ce_n", 0),
 			self.constraints.request("gpmc_ce_n", 1),
 			dmareq_pins,
-			streams_from, streams_to)
+			streams_from, streams_to,
+			burst=self.gpmc_burst,
+			csr_read_latency=self.csrs.read_latency)
 		self.csrs.master = gpmc_bridge.csr
+		self.csrs.master_stb = gpmc_bridge.csr_stb
+		
+		comb = []
+		if self.events.groups and self.irq_resource is not None:
+			comb.append(self.constraints.request(*self.irq_resource).eq(self.events.irq))
 		
 		return self.csrs.get_fragment() + \
+			self.events.get_fragment() + \
 			gpmc_bridge.get_fragment() + \
-			sum([c.get_fragment() for c in self.all_components], Fragment())
+			Fragment(comb)
 	
 	def get_symtab(self):
 		return self.csrs.get_symtab(CSR_BASE) + \
 			self.streams.get_symtab(DMA_BASE, DMA_PORT_RANGE)
+	
+	def get_memory_map(self):
+		return self.csrs.get_memory_map()
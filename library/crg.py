@@ -2,6 +2,7 @@ from migen.fhdl.structure import *
 from migen.bank.description import *
 
 from library.uid import UID_FMC150_CRG
+from tools.mmgr import EventSource, EVENT_LEVEL
 
 class CRG:
 	def get_clock_domains(self):
@@ -11,6 +12,12 @@ class CRG:
 				r[v.name] = v
 		return r
 
+	# TIMESPEC covering each clock domain, used to key timing reports.
+	# Values are TIMESPEC names, or signals driven by a PLL/DCM output whose
+	# derived TIMESPEC is named after their net (TS_<net>).
+	def get_timespecs(self):
+		return dict()
+
 class CRG100(CRG):
 	def __init__(self, baseapp):
 		self.cd = ClockDomain("sys")
@@ -40,6 +47,9 @@ TIMESPEC "TSclk_100" = PERIOD "GRPclk_100" 10 ns HIGH 50%;
 		)
 		return Fragment(instances=[ibufg, reset_srl])
 
+	def get_timespecs(self):
+		return {"sys": "TSclk_100"}
+
 # Clock generation for the FMC150
 # ADC samples at 122.88MHz
 #    I/O is DDR (using IDDR2)
@@ -58,15 +68,28 @@ TIMESPEC "TSclk_100" = PERIOD "GRPclk_100" 10 ns HIGH 50%;
 #      Channels are multiplexed
 #      => Generate 4x (491.52MHz for DAC clock pins)
 #         and 8x (983.04MHz for OSERDES) clocks
+#
+# When wg_divide > 1:
+#   Generate the wg clock at 1/wg_divide of the 1x clock, phase aligned with
+#   it, for waveform generators producing more samples per cycle
 class CRGFMC150(CRG):
-	def __init__(self, baseapp, csr_name="crg", double_dac=True):
+	def __init__(self, baseapp, csr_name="crg", double_dac=True, wg_divide=1):
 		self._double_dac = double_dac
+		self._wg_divide = wg_divide
 		
 		self.cd_sys = ClockDomain("sys")
 		self.cd_dac = ClockDomain("dac")
 		self.cd_dacio = ClockDomain("dacio")
 		self.dacio_strb = Signal()
 		
+		# PLL outputs for the sys, dacio and dac clocks
+		self._pll_out0 = Signal()
+		self._pll_out1 = Signal()
+		self._pll_out2 = Signal()
+		self._pll_out3 = Signal()
+		if self._wg_divide > 1:
+			self.cd_wg = ClockDomain("wg")
+
 		self._clk100 = baseapp.constraints.request("clk100")
 		self._fmc_clocks = baseapp.constraints.request("fmc150_clocks")
 
@@ -80,7 +103,9 @@ TIMESPEC "TSclk_adc" = PERIOD "GRPclk_adc" 8.13 ns HIGH 50%;
 		self.reg_pll_enable = RegisterField("pll_enable")
 		self.reg_pll_locked = RegisterField("pll_locked", access_bus=READ_ONLY, access_dev=WRITE_ONLY)
 		self.reg_clock_sel = RegisterField("clock_sel")
-		baseapp.csrs.request(csr_name, UID_FMC150_CRG, self.reg_pll_enable, self.reg_pll_locked, self.reg_clock_sel)
+		self.ev_pll_locked = EventSource("pll_locked", self.reg_pll_locked.field.w, EVENT_LEVEL)
+		baseapp.csrs.request(csr_name, UID_FMC150_CRG, self.reg_pll_enable, self.reg_pll_locked, self.reg_clock_sel,
+			*baseapp.events.request(self.ev_pll_locked))
 	
 	def get_fragment(self):
 		# receive differential 100MHz clock
@@ -104,9 +129,9 @@ TIMESPEC "TSclk_adc" = PERIOD "GRPclk_adc" 8.13 ns HIGH 50%;
 		pll_locked = Signal()
 		pll_fb1 = Signal()
 		pll_fb2 = Signal()
-		pll_out0 = Signal()
-		pll_out1 = Signal()
-		pll_out2 = Signal()
+		pll_out0 = self._pll_out0
+		pll_out1 = self._pll_out1
+		pll_out2 = self._pll_out2
 		pll = Instance("PLL_BASE",
 			Instance.Parameter("BANDWIDTH", "OPTIMIZED"),
 			Instance.Parameter("CLKFBOUT_MULT", 8),
@@ -138,10 +163,11 @@ TIMESPEC "TSclk_adc" = PERIOD "GRPclk_adc" 8.13 ns HIGH 50%;
 			Instance.Parameter("CLKOUT2_PHASE", -45.0),
 			Instance.Output("CLKOUT2", pll_out2),
 			
-			Instance.Parameter("CLKOUT3_DIVIDE", 8),
+			# 1x/wg_divide waveform generator clock
+			Instance.Parameter("CLKOUT3_DIVIDE", 8*self._wg_divide),
 			Instance.Parameter("CLKOUT3_DUTY_CYCLE", 0.5),
 			Instance.Parameter("CLKOUT3_PHASE", 0.0),
-			Instance.Output("CLKOUT3"),
+			Instance.Output("CLKOUT3", self._pll_out3),
 			
 			Instance.Parameter("CLKOUT4_DIVIDE", 8),
 			Instance.Parameter("CLKOUT4_DUTY_CYCLE", 0.5),
@@ -230,8 +256,26 @@ TIMESPEC "TSclk_adc" = PERIOD "GRPclk_adc" 8.13 ns HIGH 50%;
 			self.reg_pll_locked.field.w.eq(pll_locked)
 		]
 		
-		return Fragment(comb, instances=[ibufds100, ibufgds,
+		instances = [ibufds100, ibufgds,
 			pll, bufg_fb, bufg_pll0,
 			bufg_1x, bufg_dac, bufpll_dacio,
 			oddr2_dac, obufds_dac,
-			reset_srl])
+			reset_srl]
+		if self._wg_divide > 1:
+			instances.append(Instance("BUFG",
+				Instance.Input("I", self._pll_out3),
+				Instance.Output("O", self.cd_wg.clk)
+			))
+			comb.append(self.cd_wg.rst.eq(self.cd_sys.rst))
+		
+		return Fragment(comb, instances=instances)
+
+	def get_timespecs(self):
+		r = {
+			"sys": self._pll_out0,
+			"dacio": self._pll_out1,
+			"dac": self._pll_out2
+		}
+		if self._wg_divide > 1:
+			r["wg"] = self._pll_out3
+		return r
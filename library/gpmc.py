@@ -2,39 +2,146 @@ from migen.fhdl.structure import *
 from migen.bus import csr
 
 # TODO: rewrite in full FHDL
-# TODO: support streams
 
+# Streams are mapped to consecutive ports of 4096 words in the DMA chip
+# select area, streams from the host first (as in StreamManager.get_symtab).
+# The address within a port is ignored. Each stream goes through a clock
+# domain crossing FIFO of fifo_depth words, and its DMA request line (active
+# low) is asserted while the FIFO can accept (from the host) or provide (to
+# the host) a whole DMA element of dma_element words. The host DMA must
+# move at most dma_element words per request.
+# With burst, CSRs are accessed with synchronous bursts, the host must then
+# sample read data burst_read_latency gpmc_clk cycles after asserting OE,
+# and assert WE by the end of the address phase of writes.
+# csr_read_latency is the number of cycles from CSR address to read data.
+# csr_stb pulses at each CSR access, once csr.adr holds its address.
 class GPMC:
-	def __init__(self, gpmc_pins, csr_cs_pin, dma_cs_pin, dmareq_pins, streams_from, streams_to):
+	def __init__(self, gpmc_pins, csr_cs_pin, dma_cs_pin, dmareq_pins, streams_from, streams_to,
+	  fifo_depth=64, dma_element=16, burst=False, burst_read_latency=12, csr_read_latency=1):
 		self._gpmc_pins = gpmc_pins
 		self._csr_cs_pin = csr_cs_pin
 		self._dma_cs_pin = dma_cs_pin
 		self._dmareq_pins = dmareq_pins
 		self._streams_from = streams_from
 		self._streams_to = streams_to
+		self._fifo_depth = fifo_depth
+		self._dma_element = dma_element
+		self._burst = burst
+		self._burst_read_latency = burst_read_latency
+		self._csr_read_latency = csr_read_latency
 		
 		assert(csr.data_width == 16)
 		self.csr = csr.Interface()
+		self.csr_stb = Signal()
 		
-		if self._dmareq_pins or self._streams_from or self._streams_to:
-			raise NotImplementedError
+		assert(len(self._dmareq_pins) == len(self._streams_from) + len(self._streams_to))
+		for port in self._streams_from + self._streams_to:
+			assert(len(port.data) == 16)
+		assert(fifo_depth >= 4 and fifo_depth & (fifo_depth - 1) == 0)
+		assert(1 <= dma_element <= fifo_depth)
+		
+		self._dma_stream = Signal(14)
+		self._dma_we = Signal()
+		self._dma_dat_w = Signal(16)
+		self._dma_re = Signal()
+		self._dma_dat_r = Signal(16)
+	
+	# Clocks are either the name of a clock domain or a signal
+	# almost_empty is set while there is less than a DMA element to read,
+	# almost_full while there is no room for one
+	def _get_fifo(self, data_in, full, almost_full, write_en, clk_write,
+	  data_out, empty, almost_empty, read_en, clk_read):
+		def clock_port(name, clk):
+			if isinstance(clk, str):
+				return Instance.ClockPort(name, clk)
+			else:
+				return Instance.Input(name, clk)
+		return Instance("asfifo",
+			Instance.Parameter("data_width", 16),
+			Instance.Parameter("address_width", self._fifo_depth.bit_length() - 1),
+			Instance.Parameter("almost_empty_level", self._dma_element - 1),
+			Instance.Parameter("almost_full_level", self._fifo_depth - self._dma_element + 1),
+			
+			Instance.Output("data_out", data_out),
+			Instance.Output("empty", empty),
+			Instance.Output("almost_empty", almost_empty),
+			Instance.Input("read_en", read_en),
+			clock_port("clk_read", clk_read),
+			
+			Instance.Input("data_in", data_in),
+			Instance.Output("full", full),
+			Instance.Output("almost_full", almost_full),
+			Instance.Input("write_en", write_en),
+			clock_port("clk_write", clk_write),
+			
+			Instance.ResetPort("rst")
+		)
+	
+	def _get_streams_fragment(self):
+		comb = []
+		instances = []
+		gpmc_clk = self._gpmc_pins.clk
+		streams = [(port, True) for port in self._streams_from] \
+			+ [(port, False) for port in self._streams_to]
+		for i, ((port, from_ext), dmareq_n) in enumerate(zip(streams, self._dmareq_pins)):
+			selected = Signal()
+			empty = Signal()
+			almost_empty = Signal()
+			full = Signal()
+			almost_full = Signal()
+			read_en = Signal()
+			write_en = Signal()
+			comb.append(selected.eq(self._dma_stream == i))
+			if from_ext:
+				instances.append(self._get_fifo(self._dma_dat_w, full, almost_full, write_en, gpmc_clk,
+					port.data, empty, almost_empty, read_en, "sys"))
+				comb += [
+					write_en.eq(self._dma_we & selected),
+					port.stb.eq(~empty),
+					read_en.eq(port.ack),
+					dmareq_n.eq(almost_full)
+				]
+			else:
+				data_out = Signal(16)
+				instances.append(self._get_fifo(port.data, full, almost_full, write_en, "sys",
+					data_out, empty, almost_empty, read_en, gpmc_clk))
+				comb += [
+					write_en.eq(port.stb),
+					port.ack.eq(~full),
+					read_en.eq(self._dma_re & selected),
+					If(selected, self._dma_dat_r.eq(data_out)),
+					dmareq_n.eq(almost_empty)
+				]
+		return Fragment([self._dma_dat_r.eq(0)] + comb, instances=instances)
 
 	def get_fragment(self):
 		inst = Instance("gpmc",
+			Instance.Parameter("csr_burst", int(self._burst)),
+			Instance.Parameter("read_latency", self._burst_read_latency),
+			Instance.Parameter("csr_read_latency", self._csr_read_latency),
+			
 			Instance.ClockPort("sys_clk"),
 			Instance.ResetPort("sys_rst"),
 			
+			Instance.Output("csr_stb", self.csr_stb),
 			Instance.Output("csr_adr", self.csr.adr),
 			Instance.Output("csr_we", self.csr.we),
 			Instance.Output("csr_dat_w", self.csr.dat_w),
 			Instance.Input("csr_dat_r", self.csr.dat_r),
 			
+			Instance.Output("dma_stream", self._dma_stream),
+			Instance.Output("dma_we", self._dma_we),
+			Instance.Output("dma_dat_w", self._dma_dat_w),
+			Instance.Output("dma_re", self._dma_re),
+			Instance.Input("dma_dat_r", self._dma_dat_r),
+			
 			Instance.Input("gpmc_clk", self._gpmc_pins.clk),
 			Instance.Input("gpmc_a", self._gpmc_pins.a),
 			Instance.Input("gpmc_we_n", self._gpmc_pins.we_n),
 			Instance.Input("gpmc_oe_n", self._gpmc_pins.oe_n),
 			Instance.Input("gpmc_ale_n", self._gpmc_pins.ale_n),
 			Instance.Input("gpmc_csr_cs_n", self._csr_cs_pin),
+			Instance.Input("gpmc_dma_cs_n", self._dma_cs_pin),
 			Instance.InOut("gpmc_d", self._gpmc_pins.d)
 		)
-		return Fragment(instances=[inst])
+		return Fragment(instances=[inst]) + self._get_streams_fragment()
@@ -2,22 +2,31 @@
  * This file is based on "Asynchronous FIFO" by Alex Claros F.,
  * itself based on the article "Asynchronous FIFO in Virtex-II FPGAs"
  * by Peter Alfke.
+ *
+ * almost_empty is set (clk_read domain) while the FIFO holds
+ * almost_empty_level words or less, almost_full (clk_write domain) while it
+ * holds almost_full_level words or more. Both take into account the
+ * accesses of the other domain with a delay, erring on the safe side.
  */
 
 module asfifo #(
 	parameter data_width = 8,
 	parameter address_width = 4,
-	parameter fifo_depth = (1 << address_width)
+	parameter fifo_depth = (1 << address_width),
+	parameter almost_empty_level = 0,
+	parameter almost_full_level = fifo_depth
 ) (
 	/* Read port */
 	output [data_width-1:0] data_out,
 	output reg empty,
+	output almost_empty,
 	input read_en,
 	input clk_read,
 	
 	/* Write port */
 	input [data_width-1:0] data_in,
 	output reg full,
+	output almost_full,
 	input write_en,
 	input clk_write,
 	
@@ -95,4 +104,70 @@ always @(posedge clk_read, posedge preset_empty) begin
 		empty <= 1'b0;
 end
 
+/*
+ * Fill levels, from counts of the words written and read one bit wider
+ * than the addresses, crossing the clock domains in Gray code.
+ */
+function [address_width:0] bin2gray(input [address_width:0] b);
+	bin2gray = b ^ (b >> 1);
+endfunction
+
+function [address_width:0] gray2bin(input [address_width:0] g);
+	integer i;
+	begin
+		gray2bin[address_width] = g[address_width];
+		for(i = address_width - 1; i >= 0; i = i - 1)
+			gray2bin[i] = gray2bin[i+1] ^ g[i];
+	end
+endfunction
+
+reg [address_width:0] write_count;
+reg [address_width:0] write_count_gray;
+reg [address_width:0] read_count;
+reg [address_width:0] read_count_gray;
+
+always @(posedge clk_write, posedge rst) begin
+	if(rst) begin
+		write_count <= 0;
+		write_count_gray <= 0;
+	end else if(write_en_safe) begin
+		write_count <= write_count + 1;
+		write_count_gray <= bin2gray(write_count + 1);
+	end
+end
+
+always @(posedge clk_read, posedge rst) begin
+	if(rst) begin
+		read_count <= 0;
+		read_count_gray <= 0;
+	end else if(read_en_safe) begin
+		read_count <= read_count + 1;
+		read_count_gray <= bin2gray(read_count + 1);
+	end
+end
+
+reg [address_width:0] read_count_gray_0;
+reg [address_width:0] read_count_gray_1;
+// synthesis attribute shreg_extract of read_count_gray_0 is no
+// synthesis attribute shreg_extract of read_count_gray_1 is no
+always @(posedge clk_write) begin
+	read_count_gray_0 <= read_count_gray;
+	read_count_gray_1 <= read_count_gray_0;
+end
+
+reg [address_width:0] write_count_gray_0;
+reg [address_width:0] write_count_gray_1;
+// synthesis attribute shreg_extract of write_count_gray_0 is no
+// synthesis attribute shreg_extract of write_count_gray_1 is no
+always @(posedge clk_read) begin
+	write_count_gray_0 <= write_count_gray;
+	write_count_gray_1 <= write_count_gray_0;
+end
+
+wire [address_width:0] level_write = write_count - gray2bin(read_count_gray_1);
+wire [address_width:0] level_read = gray2bin(write_count_gray_1) - read_count;
+
+assign almost_full = full | (level_write >= almost_full_level);
+assign almost_empty = empty | (level_read <= almost_empty_level);
+
 endmodule
@@ -1,4 +1,20 @@
-module gpmc(
+/*
+ * csr_burst: 0 for asynchronous single accesses on the CSR chip select,
+ *            1 for synchronous bursts
+ * read_latency: in burst mode, gpmc_clk cycles from OE assertion to the
+ *               sampling of the first word by the host
+ * csr_read_latency: sys_clk cycles from CSR address to read data
+ *
+ * csr_stb pulses at each CSR access, once csr_adr holds its address. In
+ * asynchronous mode, it goes through a pulse synchronizer and comes about a
+ * gpmc_clk and a sys_clk cycle after csr_adr takes the address, which adds
+ * to the read access time of registers latched on it (AtomicRegister).
+ */
+module gpmc #(
+	parameter csr_burst = 0,
+	parameter read_latency = 12,
+	parameter csr_read_latency = 1
+) (
 	/*
 	 * System
 	 */
@@ -8,10 +24,20 @@ module gpmc(
 	/*
 	 * CSR
 	 */
-	output reg [13:0] csr_adr,
+	output csr_stb,
+	output [13:0] csr_adr,
 	output csr_we,
 	input [15:0] csr_dat_r,
-	output reg [15:0] csr_dat_w,
+	output [15:0] csr_dat_w,
+
+	/*
+	 * DMA (gpmc_clk domain)
+	 */
+	output [13:0] dma_stream,
+	output dma_we,
+	output reg [15:0] dma_dat_w,
+	output dma_re,
+	input [15:0] dma_dat_r,
 
 	/*
 	 * GPMC
@@ -23,7 +49,8 @@ module gpmc(
 	input gpmc_oe_n,
 	input gpmc_ale_n,
 	
-	input gpmc_csr_cs_n
+	input gpmc_csr_cs_n,
+	input gpmc_dma_cs_n
 );
 
 /*
@@ -38,29 +65,41 @@ always @(posedge gpmc_clk)
  * CSR
  */
 
+wire [15:0] csr_dat_r_gpmc;
+wire csr_oe_gpmc;
+
+generate
+if(csr_burst == 0) begin : csr_async
+
 /* synchronize address and write data to sys_clk domain */
 reg [13:0] csr_adr_0;
 reg [15:0] csr_dat_w_0;
+reg [13:0] csr_adr_1;
+reg [15:0] csr_dat_w_1;
 // synthesis attribute shreg_extract of csr_adr_0 is no
-// synthesis attribute shreg_extract of csr_adr is no
+// synthesis attribute shreg_extract of csr_adr_1 is no
 // synthesis attribute shreg_extract of csr_dat_w_0 is no
-// synthesis attribute shreg_extract of csr_dat_w is no
+// synthesis attribute shreg_extract of csr_dat_w_1 is no
 always @(posedge sys_clk) begin
 	csr_adr_0 <= gpmc_ar[13:0];
 	csr_dat_w_0 <= gpmc_d[15:0];
-	csr_adr <= csr_adr_0;
-	csr_dat_w <= csr_dat_w_0;
+	csr_adr_1 <= csr_adr_0;
+	csr_dat_w_1 <= csr_dat_w_0;
 end
+assign csr_adr = csr_adr_1;
+assign csr_dat_w = csr_dat_w_1;
 
 /* synchronize read data to gpmc_clk domain */
 reg [15:0] csr_dat_r_gpmc_0;
-reg [15:0] csr_dat_r_gpmc;
+reg [15:0] csr_dat_r_gpmc_1;
 // synthesis attribute shreg_extract of csr_dat_r_gpmc_0 is no
-// synthesis attribute shreg_extract of csr_dat_r_gpmc is no
+// synthesis attribute shreg_extract of csr_dat_r_gpmc_1 is no
 always @(posedge gpmc_clk) begin
 	csr_dat_r_gpmc_0 <= csr_dat_r;
-	csr_dat_r_gpmc <= csr_dat_r_gpmc_0;
+	csr_dat_r_gpmc_1 <= csr_dat_r_gpmc_0;
 end
+assign csr_dat_r_gpmc = csr_dat_r_gpmc_1;
+assign csr_oe_gpmc = ~gpmc_csr_cs_n & ~gpmc_oe_n & gpmc_ale_n;
 
 /* synchronize write pulse */
 wire csr_wp_gpmc;
@@ -81,7 +120,209 @@ always @(posedge gpmc_clk)
 
 assign csr_wp_gpmc = csr_we_gpmc & ~csr_we_gpmc_r;
 
+/* access strobe, at the end of the address phase. It reaches sys_clk
+ * after csr_adr_1 has taken the new address. */
+wire csr_ap_gpmc;
+reg csr_ale_n_r;
+wire csr_ap_sys;
+reg csr_stb_r;
+
+always @(posedge gpmc_clk)
+	csr_ale_n_r <= gpmc_ale_n;
+assign csr_ap_gpmc = ~gpmc_csr_cs_n & gpmc_ale_n & ~csr_ale_n_r;
+psync sync_csr_stb(
+	.clk1(gpmc_clk),
+	.i(csr_ap_gpmc),
+	.clk2(sys_clk),
+	.o(csr_ap_sys)
+);
+always @(posedge sys_clk)
+	csr_stb_r <= csr_ap_sys;
+assign csr_stb = csr_stb_r;
+
+end else begin : csr_sync
+
+/*
+ * Synchronous burst mode.
+ * Each address phase of a read starts a prefetch of 16 words (the longest
+ * GPMC burst) from that address, each written word goes to the next address.
+ * The host must assert WE by the end of the address phase of writes, no
+ * prefetch is started for them.
+ * Commands cross to sys_clk through a FIFO:
+ *   {write, generation, address, data}
+ * The generation is incremented at each address phase. Prefetched words are
+ * stored in a buffer by generation parity and position in the burst, so
+ * that the words of an earlier address phase are never returned. Reads in
+ * flight when a new read command arrives are dropped.
+ * The host must sample the first word read_latency gpmc_clk cycles after
+ * asserting OE, then one word per cycle. A word is written at each
+ * gpmc_clk cycle with WE asserted.
+ */
+
+/* gpmc_clk side */
+reg ale_n_r;
+reg ap_we;
+always @(posedge gpmc_clk) begin
+	ale_n_r <= gpmc_ale_n;
+	if(~gpmc_ale_n)
+		ap_we <= ~gpmc_we_n;
+end
+
+wire address_phase_end = ~gpmc_csr_cs_n & gpmc_ale_n & ~ale_n_r;
+wire burst_we = ~gpmc_csr_cs_n & gpmc_ale_n & ~gpmc_we_n;
+wire burst_oe = ~gpmc_csr_cs_n & gpmc_ale_n & ~gpmc_oe_n;
+wire prefetch = address_phase_end & ~ap_we & gpmc_we_n;
+
+reg [13:0] burst_adr;
+reg [3:0] burst_gen;
+wire [13:0] write_adr = address_phase_end ? gpmc_ar[13:0] : burst_adr;
+
+always @(posedge gpmc_clk) begin
+	if(address_phase_end) begin
+		burst_adr <= gpmc_ar[13:0];
+		burst_gen <= burst_gen + 4'd1;
+	end
+	if(burst_we)
+		burst_adr <= write_adr + 14'd1;
+end
+
+initial burst_gen <= 4'd0;
+
+wire [34:0] cmd_in = burst_we
+	? {1'b1, burst_gen, write_adr, gpmc_d}
+	: {1'b0, burst_gen + 4'd1, gpmc_ar[13:0], 16'd0};
+wire [34:0] cmd_out;
+wire cmd_empty;
+wire cmd_full;
+wire cmd_re = ~cmd_empty & ~sys_rst;
+
+asfifo #(
+	.data_width(35),
+	.address_width(5)
+) cmd_fifo (
+	.data_out(cmd_out),
+	.empty(cmd_empty),
+	.read_en(cmd_re),
+	.clk_read(sys_clk),
+	
+	.data_in(cmd_in),
+	.full(cmd_full),
+	.write_en(burst_we | prefetch),
+	.clk_write(gpmc_clk),
+	
+	.rst(sys_rst)
+);
+
+reg [7:0] oe_count;
+always @(posedge gpmc_clk) begin
+	if(burst_oe) begin
+		if(oe_count != read_latency - 1)
+			oe_count <= oe_count + 8'd1;
+	end else
+		oe_count <= 8'd0;
+end
+
+/* prefetched words, by {generation parity, word in the burst} */
+reg [15:0] ret_mem[0:31];
+reg [3:0] oe_word;
+always @(posedge gpmc_clk) begin
+	if(address_phase_end)
+		oe_word <= 4'd0;
+	else if(burst_oe & (oe_count == read_latency - 1))
+		oe_word <= oe_word + 4'd1;
+end
+
+assign csr_dat_r_gpmc = ret_mem[{burst_gen[0], oe_word}];
+assign csr_oe_gpmc = burst_oe;
+
+/* sys_clk side */
+reg [13:0] csr_adr_r;
+reg csr_stb_r;
+reg csr_we_r;
+reg [15:0] csr_dat_w_r;
+assign csr_stb = csr_stb_r;
+assign csr_adr = csr_adr_r;
+assign csr_we = csr_we_r;
+assign csr_dat_w = csr_dat_w_r;
+
+reg [13:0] pf_adr;
+reg [3:0] pf_gen;
+reg [3:0] pf_word;
+reg [4:0] pf_count;
+/* reads in flight on the CSR bus, with their {generation, word} */
+reg [csr_read_latency:0] rd_valid;
+reg [8*csr_read_latency+7:0] rd_tag;
+wire [7:0] rd_tag_out = rd_tag[8*csr_read_latency+7:8*csr_read_latency];
+
+always @(posedge sys_clk) begin
+	csr_stb_r <= 1'b0;
+	csr_we_r <= 1'b0;
+	rd_valid <= {rd_valid[csr_read_latency-1:0], 1'b0};
+	rd_tag <= {rd_tag[8*csr_read_latency-1:0], pf_gen, pf_word};
+	if(rd_valid[csr_read_latency] & (rd_tag_out[7:4] == pf_gen))
+		ret_mem[{rd_tag_out[4], rd_tag_out[3:0]}] <= csr_dat_r;
+	if(sys_rst) begin
+		pf_count <= 5'd0;
+		rd_valid <= 0;
+	end else if(cmd_re) begin
+		if(cmd_out[34]) begin
+			csr_adr_r <= cmd_out[29:16];
+			csr_dat_w_r <= cmd_out[15:0];
+			csr_stb_r <= 1'b1;
+			csr_we_r <= 1'b1;
+			pf_count <= 5'd0;
+		end else begin
+			pf_adr <= cmd_out[29:16];
+			pf_gen <= cmd_out[33:30];
+			pf_word <= 4'd0;
+			pf_count <= 5'd16;
+		end
+	end else if(pf_count != 5'd0) begin
+		csr_adr_r <= pf_adr;
+		csr_stb_r <= 1'b1;
+		pf_adr <= pf_adr + 14'd1;
+		pf_word <= pf_word + 4'd1;
+		pf_count <= pf_count - 5'd1;
+		rd_valid[0] <= 1'b1;
+	end
+end
+
+end
+endgenerate
+
+/*
+ * DMA
+ */
+
+/* each stream has a port of 4096 words */
+assign dma_stream = gpmc_ar[25:12];
+
+/* generate write pulse at the end of the access, with the last data */
+wire dma_we_gpmc;
+reg dma_we_gpmc_r;
+
+assign dma_we_gpmc = ~gpmc_dma_cs_n & gpmc_ale_n & ~gpmc_we_n;
+always @(posedge gpmc_clk) begin
+	dma_we_gpmc_r <= dma_we_gpmc;
+	if(dma_we_gpmc)
+		dma_dat_w <= gpmc_d;
+end
+
+assign dma_we = dma_we_gpmc_r & ~dma_we_gpmc;
+
+/* generate read pulse at the end of the access, to move to the next word */
+wire dma_oe_gpmc;
+reg dma_oe_gpmc_r;
+
+assign dma_oe_gpmc = ~gpmc_dma_cs_n & gpmc_ale_n & ~gpmc_oe_n;
+always @(posedge gpmc_clk)
+	dma_oe_gpmc_r <= dma_oe_gpmc;
+
+assign dma_re = dma_oe_gpmc_r & ~dma_oe_gpmc;
+
 /* drive read data */
-assign gpmc_d = (~gpmc_csr_cs_n & ~gpmc_oe_n & gpmc_ale_n) ? csr_dat_r_gpmc : 16'hzzzz;
+assign gpmc_d = csr_oe_gpmc ? csr_dat_r_gpmc
+	: dma_oe_gpmc ? dma_dat_r
+	: 16'hzzzz;
 
 endmodule
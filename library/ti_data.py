@@ -296,6 +296,73 @@ class DAC2X(_BaseDAC):
 		
 		return Fragment(comb, sync, instances=inst)
 
+# Feeds DAC2X from spc (4 or 8) samples per channel and cycle of
+# clock_domain, which must be phase aligned with sys and spc/2 times slower.
+# Each sys cycle sends the next two samples of the last token.
+class DACInterleaver(Actor):
+	def __init__(self, width, spc, clock_domain):
+		self._spc = spc
+		self._clock_domain = clock_domain
+		
+		layout_in = [("i" + str(n), width) for n in range(spc)] \
+			+ [("q" + str(n), width) for n in range(spc)]
+		layout_out = [
+			("i0", width),
+			("q0", width),
+			("i1", width),
+			("q1", width)
+		]
+		Actor.__init__(self,
+			("samples_in", Sink, layout_in),
+			("samples", Source, layout_out))
+	
+	def get_fragment(self):
+		token_in = self.token("samples_in")
+		token_out = self.token("samples")
+		width = len(token_in.i0)
+		ratio = self._spc//2
+		
+		# detect the first sys cycle of each cycle of the slow domain
+		toggle = Signal()
+		toggle_r = Signal()
+		new = Signal()
+		
+		lanes_i = [Signal(width) for n in range(self._spc)]
+		lanes_q = [Signal(width) for n in range(self._spc)]
+		stb = Signal()
+		index = Signal(bits_for(ratio-1))
+		comb = [
+			new.eq(toggle != toggle_r),
+			self.endpoints["samples_in"].ack.eq(self.endpoints["samples"].ack),
+			self.endpoints["samples"].stb.eq(stb)
+		]
+		for n in range(ratio):
+			comb.append(If(index == n,
+				token_out.i0.eq(lanes_i[2*n]),
+				token_out.q0.eq(lanes_q[2*n]),
+				token_out.i1.eq(lanes_i[2*n+1]),
+				token_out.q1.eq(lanes_q[2*n+1])
+			))
+		sync = [
+			toggle_r.eq(toggle),
+			If(new,
+				stb.eq(self.endpoints["samples_in"].stb),
+				index.eq(0)
+			).Else(
+				index.eq(index + 1)
+			)
+		]
+		for n in range(self._spc):
+			sync.append(If(new,
+				lanes_i[n].eq(getattr(token_in, "i" + str(n))),
+				lanes_q[n].eq(getattr(token_in, "q" + str(n)))
+			))
+		
+		return Fragment(comb, {
+			"sys": sync,
+			self._clock_domain: [toggle.eq(~toggle)]
+		})
+
 class ADC(Actor):
 	def __init__(self, pins):
 		self._pins = pins
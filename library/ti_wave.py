@@ -3,29 +3,64 @@ from migen.flow.plumbing import Buffer
 from migen.actorlib.spi import Collector
 from migen.bank.description import regprefix
 
+from tools.mmgr import EventSource, FROM_EXT
+
 from library.uid import UID_WAVEFORM_GENERATOR, UID_WAVEFORM_COLLECTOR
 from library.waveform_generator import WaveformGenerator
-from library.ti_data import DAC, DAC2X, ADC
+from library.ti_data import DAC, DAC2X, DACInterleaver, ADC
 
+# The memories are CSR windows (wg_mem0 and wg_mem1) only with 1 sample per
+# cycle and without interpolate, otherwise load them through i_load and
+# q_load.
+# Memories deeper than 512 samples are paged on the CSR bus.
+# double_buffer: see WaveformGenerator
+# stream: play I and Q samples from the wg_i_stream and wg_q_stream streams
+# in MODE_STREAM (see WaveformGenerator)
+# frac_bits, interpolate: DDS playback (see WaveformGenerator)
+# The samples per cycle are given by baseapp.dac_spc, above 2 the generators
+# run in the wg clock domain and feed the DAC through a DACInterleaver.
 class FullWaveformGenerator(CompositeActor):
-	def __init__(self, baseapp):
+	def __init__(self, baseapp, depth=1024, double_buffer=False, stream=False, stream_depth=512,
+	  frac_bits=0, interpolate=False):
 		dac_pins = baseapp.constraints.request("ti_dac")
 		width = 2*len(dac_pins.dat_p)
 		
-		spc = 2 if baseapp.double_dac else 1
+		spc = getattr(baseapp, "dac_spc", 2 if baseapp.double_dac else 1)
 		dac_class = DAC2X if baseapp.double_dac else DAC
+		clock_domain = "wg" if spc > 2 else "sys"
 		
-		wg_i = WaveformGenerator(1024, width, spc)
-		wg_q = WaveformGenerator(1024, width, spc)
+		if stream:
+			stream_i = baseapp.streams.request("wg_i_stream", FROM_EXT)
+			stream_q = baseapp.streams.request("wg_q_stream", FROM_EXT)
+		else:
+			stream_i = stream_q = None
+		wg_i = WaveformGenerator(depth, width, spc, double_buffer, stream_i, stream_depth,
+			frac_bits, interpolate, clock_domain)
+		wg_q = WaveformGenerator(depth, width, spc, double_buffer, stream_q, stream_depth,
+			frac_bits, interpolate, clock_domain)
 		dac = dac_class(dac_pins, baseapp.crg.dacio_strb)
 
-		registers = regprefix("i_", wg_i.get_registers()) \
-			+ regprefix("q_", wg_q.get_registers()) \
-			+ dac.get_registers()
-		baseapp.csrs.request("wg", UID_WAVEFORM_GENERATOR, *registers)
+		# events: bit 0 when I playback stops, bit 1 when Q playback stops
+		events = [EventSource("i_stopped", ~wg_i.busy, clock_domain=clock_domain),
+			EventSource("q_stopped", ~wg_q.busy, clock_domain=clock_domain)]
+		registers = regprefix("i_", wg_i.get_base_registers()) \
+			+ regprefix("q_", wg_q.get_base_registers()) \
+			+ dac.get_registers() \
+			+ regprefix("i_", wg_i.get_extra_registers()) \
+			+ regprefix("q_", wg_q.get_extra_registers()) \
+			+ baseapp.events.request(*events)
+		baseapp.csrs.request("wg", UID_WAVEFORM_GENERATOR, *registers,
+			memories=wg_i.get_memories() + wg_q.get_memories())
 		
 		g = DataFlowGraph()
-		if baseapp.double_dac:
+		if spc > 2:
+			interleaver = DACInterleaver(width, spc, clock_domain)
+			g.add_connection(wg_i, interleaver, sink_ep="samples_in",
+				sink_subr=["i" + str(n) for n in range(spc)])
+			g.add_connection(wg_q, interleaver, sink_ep="samples_in",
+				sink_subr=["q" + str(n) for n in range(spc)])
+			g.add_connection(interleaver, dac, source_ep="samples")
+		elif baseapp.double_dac:
 			g.add_connection(wg_i, dac, sink_subr=["i0", "i1"])
 			g.add_connection(wg_q, dac, sink_subr=["q0", "q1"])
 		else:
@@ -15,9 +15,11 @@ UID_VERMEER = 0x100
 
 class UID:
 	def __init__(self, uid):
+		# tools.mmgr imports this module
+		from tools.mmgr import AtomicRegister
 		self.uid = uid
-		self.reg_magic = RegisterField("magic", 32, READ_ONLY, WRITE_ONLY)
-		self.reg_uid = RegisterField("uid", 32, READ_ONLY, WRITE_ONLY)
+		self.reg_magic = AtomicRegister("magic", 32, READ_ONLY, WRITE_ONLY)
+		self.reg_uid = AtomicRegister("uid", 32, READ_ONLY, WRITE_ONLY)
 	
 	def get_registers(self):
 		return [self.reg_magic, self.reg_uid]
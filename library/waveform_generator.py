@@ -1,101 +1,662 @@
 from migen.fhdl.structure import *
+from migen.bus import csr
 from migen.bank.description import *
 from migen.flow.actor import *
 from migen.corelogic.fsm import FSM
 
+from tools.mmgr import AtomicRegister, wide_register
+
 MODE_DISABLED = 0
 MODE_LOAD = 1
 MODE_PLAYBACK = 2
+MODE_STREAM = 3
 
+# Waveforms are loaded in MODE_LOAD, either spc samples at a time through
+# data_inN and shift_data, or one sample per write to load. Do not mix both
+# in the same load.
+# With spc=1, the memory has a port left for a CSR window (get_memories).
+# Otherwise both ports are used for playback and there is no window.
+# Each memory has at most two ports, so that it maps to block RAM.
+#
+# With double_buffer, there are two memories (banks): one is played while
+# the other is loaded, in any mode. Writing swap exchanges them at the end
+# of the current period (when the address wraps), or immediately when not
+# playing. swap reads 1 until then, and bank gives the played bank. Loading
+# restarts at the beginning of the bank after each swap.
+#
+# With a stream (a FROM_EXT StreamPort), samples can also be played from the
+# host in MODE_STREAM. They go through a FIFO of stream_depth entries of spc
+# samples, and playback starts once prefill entries are queued. When the
+# FIFO runs empty, playback stops until prefill entries are queued again:
+# underflows counts these events and underflow_cycles the cycles without
+# a sample since playback first started. Both are reset when entering
+# MODE_STREAM, and are read atomically. The FIFO is emptied when leaving it.
+#
+# With frac_bits, playback addresses have frac_bits fractional bits and,
+# when dds is set, advance by step (frac_bits fractional bits) instead of
+# mult, for DDS at any frequency from a single table period. With
+# interpolate, setting the interpolate register interpolates linearly
+# between table entries (two's complement samples). The following entries
+# are read from second copies of the memories (next_banks), written along
+# with the first ones, so there is no CSR window.
+#
+# spc is 1 or even. Each memory serves two lanes (samples per cycle), so with
+# spc > 2 each bank is made of spc/2 copies of the waveform, written
+# together. shift_data then takes spc/2 cycles to write all copies.
+# The generator runs in clock_domain, CSR writes are synchronized to it
+# (streams require the sys domain).
 class WaveformGenerator(Actor):
-	def __init__(self, depth, width=16, spc=1):
+	def __init__(self, depth, width=16, spc=1, double_buffer=False, stream=None, stream_depth=512,
+	  frac_bits=0, interpolate=False, clock_domain="sys"):
+		assert(spc == 1 or spc % 2 == 0)
+		assert(stream is None or clock_domain == "sys")
+		self.clock_domain = clock_domain
 		self.depth = depth
 		self.width = width
 		self.spc = spc
+		self.double_buffer = double_buffer
+		self.stream = stream
+		self.stream_depth = stream_depth
+		self.frac_bits = frac_bits
+		self.interpolate = interpolate
 		
 		self._mode = RegisterField("mode", 2)
 		self._busy = RegisterField("busy", access_bus=READ_ONLY, access_dev=WRITE_ONLY)
-		self._size = RegisterField("size", bits_for(self.depth), reset=self.depth)
-		self._mult = RegisterField("mult", bits_for(self.depth), reset=1)
+		self._size = wide_register("size", bits_for(self.depth), reset=self.depth)
+		self._mult = wide_register("mult", bits_for(self.depth), reset=1)
 		self._data_ins = [RegisterField("data_in" + str(i), self.width) for i in range(self.spc)]
 		self._shift_data = RegisterRaw("shift_data")
+		if self.width > csr.data_width:
+			# the sample is stored when its last word is written
+			self._load = AtomicRegister("load", self.width, access_bus=WRITE_ONLY)
+			self._load_re, self._load_r = self._load.field.re, self._load.field.r
+		else:
+			self._load = RegisterRaw("load", self.width)
+			self._load_re, self._load_r = self._load.re, self._load.r
+		if self.double_buffer:
+			self._swap = RegisterRaw("swap")
+			self._bank = RegisterField("bank", access_bus=READ_ONLY, access_dev=WRITE_ONLY)
+		if self.stream is not None:
+			assert(len(self.stream.data) >= self.width)
+			self._prefill = RegisterField("prefill", bits_for(self.stream_depth), reset=self.stream_depth//2)
+			self._underflows = AtomicRegister("underflows", 32, READ_ONLY, WRITE_ONLY)
+			self._underflow_cycles = AtomicRegister("underflow_cycles", 32, READ_ONLY, WRITE_ONLY)
+		if self.frac_bits:
+			self._dds = RegisterField("dds")
+			self._step = wide_register("step", bits_for(self.depth) + self.frac_bits, reset=2**self.frac_bits)
+		if self.interpolate:
+			assert(self.frac_bits)
+			self._interpolate = RegisterField("interpolate")
+		
+		nbanks = 2 if self.double_buffer else 1
+		self._lanes_per_mem = min(self.spc, 2)
+		self.banks = [[Memory(self.width, self.depth) for i in range(self.spc//self._lanes_per_mem)]
+			for j in range(nbanks)]
+		# first copy of each bank
+		self.mems = [bank[0] for bank in self.banks]
+		self.mem = self.mems[0]
+		if self.interpolate:
+			self.next_banks = [[Memory(self.width, self.depth) for i in range(self.spc//self._lanes_per_mem)]
+				for j in range(nbanks)]
+		else:
+			self.next_banks = []
 		
 		layout = [("value" + str(i), self.width) for i in range(self.spc)]
 		Actor.__init__(self, ("sample", Source, layout))
-
-	def get_registers(self):
+	
+	# Registers of the basic generator. Banks made of several generators place
+	# them before all the get_extra_registers, so that their offsets do not
+	# depend on the options.
+	def get_base_registers(self):
 		return [self._mode, self._busy,
 			self._size, self._mult] \
 			+ self._data_ins + [self._shift_data]
+	
+	def get_extra_registers(self):
+		registers = [self._load]
+		if self.double_buffer:
+			registers += [self._swap, self._bank]
+		if self.stream is not None:
+			registers += [self._prefill, self._underflows, self._underflow_cycles]
+		if self.frac_bits:
+			registers += [self._dds, self._step]
+		if self.interpolate:
+			registers.append(self._interpolate)
+		return registers
+	
+	def get_registers(self):
+		return self.get_base_registers() + self.get_extra_registers()
+	
+	def get_memories(self):
+		if self.spc == 1 and self.clock_domain == "sys" and not self.interpolate:
+			return self.mems
+		else:
+			return []
+	
+	# Playback address of each lane and its fractional part, and load address
+	# of each port of the memories. wrap is set when the playback address of
+	# the first lane wraps at the next increment.
+	# Lanes start at n*inc and advance by spc*inc, modulo the size. These are
+	# computed again after each change of size, mult or step, by reducing inc
+	# one bit per cycle then adding it spc times. adr_ready is set once they
+	# are valid. Each lane then only compares its address with the registered
+	# limit - spc*inc to wrap.
+	def _address_generator(self, play_reset, load_reset, adr_inc_1, adr_inc_load, adr_inc_mult, wrap,
+	  adr_ready):
+		play_adrs = []
+		load_adrs = []
+		fracs = []
+		comb = []
+		sync = []
+		
+		# playback addresses are in units of 2**-frac_bits entries
+		frac_bits = self.frac_bits
+		adr_bits = bits_for(self.depth-1) + frac_bits
+		limit_bits = bits_for(self.depth) + frac_bits
+		limit = Signal(limit_bits)
+		inc_width = bits_for(self.depth) + frac_bits
+		inc = Signal(inc_width)
+		comb.append(limit.eq(self._size.field.r*2**frac_bits))
+		if frac_bits:
+			comb.append(If(self._dds.field.r,
+				inc.eq(self._step.field.r)
+			).Else(
+				inc.eq(self._mult.field.r*2**frac_bits)
+			))
+		else:
+			comb.append(inc.eq(self._mult.field.r))
+		
+		# operands of the last computation
+		inc_l = Signal(inc_width)
+		limit_l = Signal(limit_bits)
+		# inc modulo limit, reduced from the most significant bit of inc_l
+		inc_bits = Signal(inc_width)
+		remaining = Signal(bits_for(inc_width))
+		inc_mod = Signal(limit_bits + 1)
+		v_inc_mod = Signal(limit_bits + 1, variable=True)
+		# n*inc modulo limit, then spc*inc and limit - spc*inc
+		lane = Signal(bits_for(self.spc))
+		acc = Signal(limit_bits)
+		v_acc = Signal(limit_bits + 1, variable=True)
+		offsets = [0] + [Signal(limit_bits) for i in range(self.spc - 1)]
+		step = Signal(limit_bits)
+		threshold = Signal(limit_bits)
+		sync += [
+			If((inc != inc_l) | (limit != limit_l),
+				inc_l.eq(inc),
+				limit_l.eq(limit),
+				inc_bits.eq(inc),
+				remaining.eq(inc_width),
+				inc_mod.eq(0),
+				lane.eq(0),
+				acc.eq(0),
+				adr_ready.eq(0)
+			).Elif(remaining != 0,
+				v_inc_mod.eq(Cat(inc_bits[inc_width-1], inc_mod[:limit_bits])),
+				If(v_inc_mod >= limit_l,
+					v_inc_mod.eq(v_inc_mod - limit_l)
+				),
+				inc_mod.eq(v_inc_mod),
+				inc_bits.eq(Cat(0, inc_bits[:inc_width-1])),
+				remaining.eq(remaining - 1)
+			).Elif(lane != self.spc,
+				v_acc.eq(acc + inc_mod),
+				If(v_acc >= limit_l,
+					v_acc.eq(v_acc - limit_l)
+				),
+				acc.eq(v_acc),
+				lane.eq(lane + 1),
+				If(lane == self.spc - 1,
+					step.eq(v_acc),
+					threshold.eq(limit_l - v_acc)
+				),
+				*[If(lane == i - 1, offsets[i].eq(v_acc)) for i in range(1, self.spc)]
+			).Else(
+				adr_ready.eq(1)
+			)
+		]
+		
+		for i in range(self.spc):
+			play_adr = Signal(adr_bits, reset=i*2**frac_bits)
+			sync.append(If(play_reset,
+				play_adr.eq(offsets[i])
+			).Elif(adr_inc_mult,
+				If(play_adr >= threshold,
+					play_adr.eq(play_adr - threshold)
+				).Else(
+					play_adr.eq(play_adr + step)
+				)
+			))
+			play_adrs.append(play_adr[frac_bits:])
+			if frac_bits:
+				fracs.append(play_adr[:frac_bits])
+			if i == 0:
+				comb.append(wrap.eq(play_adr >= threshold))
+		
+		for n in range(self._lanes_per_mem):
+			load_adr = Signal(bits_for(self.depth-1), reset=n)
+			v_load_adr = Signal(bits_for(self.depth-1)+1, variable=True)
+			sync += [
+				v_load_adr.eq(load_adr),
+				If(load_reset,
+					v_load_adr.eq(n)
+				).Elif(adr_inc_1,
+					v_load_adr.eq(v_load_adr + self.spc)
+				).Elif(adr_inc_load,
+					v_load_adr.eq(v_load_adr + int(n == 0))
+				),
+				If(v_load_adr >= self._size.field.r,
+					v_load_adr.eq(v_load_adr - self._size.field.r)
+				),
+				load_adr.eq(v_load_adr)
+			]
+			load_adrs.append(load_adr)
+		return play_adrs, load_adrs, fracs, Fragment(comb, sync)
+	
+	# Linear interpolation between two two's complement samples, frac
+	# being the position between them in units of 2**-frac_bits
+	def _interpolate_value(self, value0, value1, frac):
+		w = self.width
+		# offset binary, so that unsigned arithmetic preserves order
+		y0 = Cat(value0[:w-1], ~value0[w-1])
+		y1 = Cat(value1[:w-1], ~value1[w-1])
+		up = Signal()
+		diff = Signal(w)
+		product = Signal(w + self.frac_bits)
+		y = Signal(w)
+		comb = [
+			up.eq(y1 >= y0),
+			If(up,
+				diff.eq(y1 - y0)
+			).Else(
+				diff.eq(y0 - y1)
+			),
+			product.eq(diff*frac),
+			If(up,
+				y.eq(y0 + product[self.frac_bits:])
+			).Else(
+				y.eq(y0 - product[self.frac_bits:])
+			)
+		]
+		return Cat(y[:w-1], ~y[w-1]), comb
+	
+	# Gather spc words of the stream into FIFO entries. Returns the FIFO
+	# output (spc samples, first in the lowest bits), whether it can be
+	# played, and the fragment. output pops the FIFO.
+	def _stream_fifo(self, stream_start, streaming, output):
+		comb = []
+		sync = []
+		
+		# gearbox
+		words = [Signal(self.width) for i in range(self.spc)]
+		count = Signal(bits_for(self.spc))
+		accept = Signal()
+		push = Signal()
+		fifo_full = Signal()
+		comb += [
+			push.eq((count == self.spc) & ~fifo_full),
+			accept.eq(streaming & self.stream.stb & ((count != self.spc) | push)),
+			self.stream.ack.eq(accept)
+		]
+		shift = [words[i].eq(words[i+1]) for i in range(self.spc-1)]
+		shift.append(words[-1].eq(self.stream.data[:self.width]))
+		sync += [
+			If(accept, *shift),
+			If(~streaming,
+				count.eq(0)
+			).Elif(push,
+				count.eq(accept)
+			).Elif(accept,
+				count.eq(count + 1)
+			)
+		]
+		
+		# FIFO, emptied when not streaming
+		fifo_out = Signal(self.spc*self.width)
+		fifo_empty = Signal()
+		fifo_re = Signal()
+		level = Signal(bits_for(self.stream_depth))
+		fifo = Instance("asfifo",
+			Instance.Parameter("data_width", self.spc*self.width),
+			Instance.Parameter("address_width", bits_for(self.stream_depth-1)),
+			
+			Instance.Output("data_out", fifo_out),
+			Instance.Output("empty", fifo_empty),
+			Instance.Input("read_en", fifo_re),
+			Instance.ClockPort("clk_read"),
+			
+			Instance.Input("data_in", Cat(*words)),
+			Instance.Output("full", fifo_full),
+			Instance.Input("write_en", push),
+			Instance.ClockPort("clk_write"),
+			
+			Instance.ResetPort("rst")
+		)
+		comb += [
+			If(streaming,
+				fifo_re.eq(output & ~fifo_empty)
+			).Else(
+				fifo_re.eq(~fifo_empty)
+			)
+		]
+		sync += [
+			If(push & ~fifo_re,
+				level.eq(level + 1)
+			).Elif(fifo_re & ~push,
+				level.eq(level - 1)
+			)
+		]
+		
+		# prefill and underflow accounting
+		started = Signal()
+		primed = Signal()
+		valid = Signal()
+		underflows = self._underflows.field.w
+		underflow_cycles = self._underflow_cycles.field.w
+		comb.append(valid.eq(started & ~fifo_empty))
+		sync += [
+			If(~streaming,
+				started.eq(0),
+				primed.eq(0)
+			).Elif(~started,
+				If((level >= self._prefill.field.r) & ~fifo_empty,
+					started.eq(1),
+					primed.eq(1)
+				)
+			).Elif(fifo_empty,
+				started.eq(0),
+				underflows.eq(underflows + 1)
+			),
+			If(primed & ~valid,
+				underflow_cycles.eq(underflow_cycles + 1)
+			),
+			If(stream_start,
+				underflows.eq(0),
+				underflow_cycles.eq(0)
+			)
+		]
+		return fifo_out, valid, Fragment(comb, sync, instances=[fifo])
+	
+	# CSR write strobes and load data, in the clock domain of the generator
+	def _csr_events(self):
+		if self.clock_domain == "sys":
+			return self._shift_data.re, self._load_re, self._load_r, \
+				self._swap.re if self.double_buffer else 0, Fragment()
 		
+		load_data = Signal(self.width)
+		sync = [If(self._load_re, load_data.eq(self._load_r))]
+		strobes = [self._shift_data.re, self._load_re]
+		if self.double_buffer:
+			strobes.append(self._swap.re)
+		outputs = []
+		instances = []
+		for strobe in strobes:
+			output = Signal()
+			instances.append(Instance("psync",
+				Instance.ClockPort("clk1"),
+				Instance.Input("i", strobe),
+				Instance.ClockPort("clk2", self.clock_domain),
+				Instance.Output("o", output)
+			))
+			outputs.append(output)
+		if not self.double_buffer:
+			outputs.append(0)
+		return outputs[0], outputs[1], load_data, outputs[2], Fragment(sync=sync, instances=instances)
+	
+	# Move the sys clock domain logic of f to the domain of the generator
+	def _to_clock_domain(self, f):
+		if self.clock_domain == "sys":
+			return f
+		sync = f.sync.get("sys", [])
+		f.sync = dict((k, v) for k, v in f.sync.items() if k != "sys")
+		f.sync[self.clock_domain] = f.sync.get(self.clock_domain, []) + sync
+		for memory in f.memories:
+			for port in memory.ports:
+				if port.clock_domain == "sys":
+					port.clock_domain = self.clock_domain
+		return f
+	
 	def get_fragment(self):
-		# memory
-		mem = Memory(self.width, self.depth)
-		mem_ports = [mem.get_port(write_capable=True, has_re=True) 
-			for i in range(self.spc)]
+		shift_data_re, load_re, load_data, swap_re, csr_f = self._csr_events()
+		
+		# memories: ports of each bank, by lane
+		lpm = self._lanes_per_mem
+		def bank_ports(banks):
+			return [sum([[mem.get_port(write_capable=True, has_re=True) for i in range(lpm)]
+				for mem in bank], []) for bank in banks]
+		mem_ports = bank_ports(self.banks)
+		next_ports = bank_ports(self.next_banks)
 		
 		# address generator
 		adr_reset = Signal()
 		adr_inc_1 = Signal()
 		adr_inc_mult = Signal()
+		adr_inc_load = Signal()
+		play_reset = Signal()
+		load_reset = Signal()
+		wrap = Signal()
+		adr_ready = Signal()
+		play_adrs, load_adrs, fracs, adr_f = self._address_generator(play_reset, load_reset,
+			adr_inc_1, adr_inc_load, adr_inc_mult, wrap, adr_ready)
 		sync = []
-		for n, port in enumerate(mem_ports):
-			v_mem_a = Signal(bits_for(self.depth-1)+1, variable=True)
+		
+		# banks
+		loading = Signal()
+		playing = Signal()
+		load_enable = Signal()
+		# bank played, and bank of the data being read
+		active = Signal()
+		active_r = Signal()
+		# per bank: loaded instead of played
+		load_sel = [Signal() for bank in self.banks]
+		comb = []
+		if self.double_buffer:
+			swap_pending = Signal()
+			do_swap = Signal()
+			comb += [
+				do_swap.eq(swap_pending & (~playing | (adr_inc_mult & wrap))),
+				play_reset.eq(adr_reset | do_swap),
+				load_reset.eq(do_swap),
+				load_enable.eq(1),
+				load_sel[0].eq(active),
+				load_sel[1].eq(~active),
+				self._swap.w.eq(swap_pending),
+				self._bank.field.w.eq(active)
+			]
 			sync += [
-				v_mem_a.eq(port.adr),
-				If(adr_reset,
-					v_mem_a.eq(n*self._mult.field.r)
-				).Elif(adr_inc_1,
-					v_mem_a.eq(v_mem_a + self.spc)
-				).Elif(adr_inc_mult,
-					v_mem_a.eq(v_mem_a + self.spc*self._mult.field.r)
+				If(swap_re,
+					swap_pending.eq(1)
 				),
-				If(v_mem_a >= self._size.field.r,
-					v_mem_a.eq(v_mem_a - self._size.field.r)
-				),
-				port.adr.eq(v_mem_a)
+				If(do_swap,
+					active.eq(~active),
+					swap_pending.eq(0)
+				)
+			]
+		else:
+			comb += [
+				play_reset.eq(adr_reset),
+				load_reset.eq(adr_reset),
+				load_enable.eq(loading),
+				load_sel[0].eq(loading)
 			]
 		
 		# glue
+		# data_inN are written in steps of lpm samples, one per port of each
+		# memory, in all memories
+		nsteps = self.spc//lpm
+		step = Signal(bits_for(nsteps))
+		step_cur = Signal(bits_for(nsteps))
 		mem_re = Signal()
 		mem_we = Signal()
-		mem_dat_ws = [port.dat_w for port in mem_ports]
-		data_in_rs = [r.field.r for r in self._data_ins]
-		comb = [
-			Cat(*mem_dat_ws).eq(Cat(*data_in_rs)),
-			self._busy.field.w.eq(self.busy)
+		load_we = Signal()
+		comb += [
+			self._busy.field.w.eq(self.busy),
+			If(step != 0,
+				step_cur.eq(step),
+				mem_we.eq(1)
+			).Elif(load_enable & shift_data_re,
+				step_cur.eq(0),
+				mem_we.eq(1)
+			),
+			adr_inc_1.eq(mem_we & (step_cur == nsteps - 1)),
+			If(load_enable & load_re,
+				load_we.eq(1),
+				adr_inc_load.eq(1)
+			)
 		]
-		for i, port in enumerate(mem_ports):
-			comb += [
-				port.re.eq(mem_re),
-				port.we.eq(mem_we),
-				getattr(self.token("sample"), "value" + str(i)).eq(port.dat_r)
-			]
+		sync += [
+			If(mem_we,
+				If(step_cur == nsteps - 1,
+					step.eq(0)
+				).Else(
+					step.eq(step_cur + 1)
+				)
+			),
+			If(mem_re, active_r.eq(active))
+		]
+		write_adrs = []
+		write_data = []
+		for n, load_adr in enumerate(load_adrs):
+			if nsteps > 1:
+				write_adr = Signal(bits_for(self.depth-1))
+				v_write_adr = Signal(bits_for(self.depth-1)+1)
+				comb += [
+					v_write_adr.eq(load_adr + lpm*step_cur),
+					If(v_write_adr >= self._size.field.r,
+						write_adr.eq(v_write_adr - self._size.field.r)
+					).Else(
+						write_adr.eq(v_write_adr)
+					)
+				]
+			else:
+				write_adr = load_adr
+			data = Signal(self.width)
+			comb += [If(step_cur == i, data.eq(self._data_ins[i*lpm + n].field.r))
+				for i in range(nsteps)]
+			write_adrs.append(write_adr)
+			write_data.append(data)
+		
+		# ports of a bank: loaded when sel, read at read_adrs otherwise
+		def connect_ports(ports, sel, read_adrs):
+			r = []
+			for i, (port, read_adr) in enumerate(zip(ports, read_adrs)):
+				r += [
+					port.re.eq(mem_re),
+					port.dat_w.eq(write_data[i % lpm]),
+					If(sel,
+						port.adr.eq(write_adrs[i % lpm]),
+						port.we.eq(mem_we)
+					).Else(
+						port.adr.eq(read_adr)
+					)
+				]
+				# the load port writes through the first port of each memory
+				if i % lpm == 0:
+					r.append(If(sel & load_we,
+						port.we.eq(1),
+						port.dat_w.eq(load_data)
+					))
+			return r
+		for ports, sel in zip(mem_ports, load_sel):
+			comb += connect_ports(ports, sel, play_adrs)
+		
+		# read data from the played bank
+		def bank_value(ports):
+			if self.double_buffer:
+				value = Signal(self.width)
+				comb.append(If(active_r,
+					value.eq(ports[1].dat_r)
+				).Else(
+					value.eq(ports[0].dat_r)
+				))
+				return value
+			else:
+				return ports[0].dat_r
+		mem_values = [bank_value([ports[i] for ports in mem_ports]) for i in range(self.spc)]
+		
+		# interpolation, from the entries following the played ones
+		if self.interpolate:
+			next_adrs = []
+			for play_adr in play_adrs:
+				next_adr = Signal(bits_for(self.depth-1))
+				comb.append(If(play_adr + 1 >= self._size.field.r,
+					next_adr.eq(0)
+				).Else(
+					next_adr.eq(play_adr + 1)
+				))
+				next_adrs.append(next_adr)
+			for ports, sel in zip(next_ports, load_sel):
+				comb += connect_ports(ports, sel, next_adrs)
+			for i, frac in enumerate(fracs):
+				frac_r = Signal(self.frac_bits)
+				sync.append(If(mem_re, frac_r.eq(frac)))
+				next_value = bank_value([ports[i] for ports in next_ports])
+				interpolated, interpolate_comb = self._interpolate_value(mem_values[i], next_value, frac_r)
+				value = Signal(self.width)
+				comb += interpolate_comb
+				comb.append(If(self._interpolate.field.r,
+					value.eq(interpolated)
+				).Else(
+					value.eq(mem_values[i])
+				))
+				mem_values[i] = value
+		
+		# stream
+		stream_start = Signal()
+		streaming = Signal()
+		stream_out = Signal()
+		if self.stream is not None:
+			stream_values, stream_valid, stream_f = self._stream_fifo(stream_start, streaming, stream_out)
+			comb.append(stream_out.eq(stream_valid & self.endpoints["sample"].ack))
+		else:
+			stream_valid = 0
+			stream_f = Fragment()
+		for i, mem_value in enumerate(mem_values):
+			value = getattr(self.token("sample"), "value" + str(i))
+			if self.stream is not None:
+				comb.append(If(streaming,
+					value.eq(stream_values[i*self.width:(i+1)*self.width])
+				).Else(
+					value.eq(mem_value)
+				))
+			else:
+				comb.append(value.eq(mem_value))
 		
 		# control
-		fsm = FSM("IDLE", "LOAD", "FLUSH", "PLAYBACK")
-		fsm.act(fsm.IDLE,
+		fsm = FSM("IDLE", "LOAD", "FLUSH", "PLAYBACK", "STREAM")
+		idle = [
 			self.busy.eq(0),
 			adr_reset.eq(1),
 			If(self._mode.field.r == MODE_LOAD, fsm.next_state(fsm.LOAD)),
-			If(self._mode.field.r == MODE_PLAYBACK, fsm.next_state(fsm.FLUSH))
+			If((self._mode.field.r == MODE_PLAYBACK) & adr_ready, fsm.next_state(fsm.FLUSH))
+		]
+		if self.stream is not None:
+			idle.append(If(self._mode.field.r == MODE_STREAM,
+				stream_start.eq(1),
+				fsm.next_state(fsm.STREAM)
+			))
+		fsm.act(fsm.IDLE, *idle)
+		fsm.act(fsm.STREAM,
+			self.busy.eq(1),
+			streaming.eq(1),
+			self.endpoints["sample"].stb.eq(stream_valid),
+			If(self._mode.field.r != MODE_STREAM, fsm.next_state(fsm.IDLE))
 		)
 		fsm.act(fsm.LOAD,
 			self.busy.eq(0),
-			If(self._shift_data.re,
-				mem_we.eq(1),
-				adr_inc_1.eq(1)
-			),
+			loading.eq(1),
 			If(self._mode.field.r != MODE_LOAD, fsm.next_state(fsm.IDLE))
 		)
 		fsm.act(fsm.FLUSH,
 			self.busy.eq(1),
+			playing.eq(1),
 			mem_re.eq(1),
 			adr_inc_mult.eq(1),
 			fsm.next_state(fsm.PLAYBACK)
 		)
 		fsm.act(fsm.PLAYBACK,
 			self.busy.eq(1),
+			playing.eq(1),
 			self.endpoints["sample"].stb.eq(1),
 			If(self.endpoints["sample"].ack,
 				adr_inc_mult.eq(1),
@@ -104,5 +665,7 @@ class WaveformGenerator(Actor):
 			)
 		)
 		
-		return fsm.get_fragment() \
-			+ Fragment(comb, sync, memories=[mem])
+		memories = sum(self.banks + self.next_banks, [])
+		return self._to_clock_domain(fsm.get_fragment()
+			+ Fragment(comb, sync, memories=memories)
+			+ adr_f + stream_f) + csr_f
@@ -130,8 +130,15 @@ PLATFORM_RESOURCES = [
 	)
 ]
 
+# dac_spc: samples per cycle and channel of the waveform generators (1, 2, 4
+# or 8). Above 2, they run in the slower wg clock domain.
+# irq_resource: pin driven by the interrupt line, e.g. ("gpio", 0). None
+# leaves the events to be polled and all GPIOs free.
 class BaseApp(RhinoBaseApp):
-	def __init__(self, components):
-		self.double_dac = True
+	def __init__(self, components, gpmc_burst=False, csr_pipeline=0, irq_resource=None,
+	  dac_spc=2):
+		self.dac_spc = dac_spc
+		self.double_dac = dac_spc > 1
 		RhinoBaseApp.__init__(self, components, PLATFORM_RESOURCES,
-			lambda app: CRGFMC150(app, double_dac=self.double_dac))
+			lambda app: CRGFMC150(app, double_dac=self.double_dac, wg_divide=max(1, dac_spc//2)),
+			gpmc_burst=gpmc_burst, csr_pipeline=csr_pipeline, irq_resource=irq_resource)
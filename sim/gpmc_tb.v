@@ -0,0 +1,260 @@
+/*
+ * Testbench of the CSR side of the GPMC bridge.
+ * In burst mode: short back-to-back burst reads, and burst writes read back.
+ * In both modes: reads of a 32-bit atomic register, which must give the two
+ * words of a single, newer value each time. Asynchronous reads are sampled
+ * async_access gpmc_clk cycles after asserting OE.
+ *
+ * $ iverilog -o gpmc_tb -Pgpmc_tb.csr_burst=1 sim/gpmc_tb.v library/hdl/gpmc.v \
+ *   library/hdl/asfifo.v library/hdl/asfifo_graycounter.v library/hdl/psync.v
+ * $ vvp gpmc_tb
+ * and the same with -Pgpmc_tb.csr_burst=0.
+ */
+`timescale 1ns/1ps
+
+module gpmc_tb();
+
+parameter csr_burst = 1;
+parameter read_latency = 12;
+parameter async_access = 8;
+
+reg sys_clk;
+reg sys_rst;
+reg gpmc_clk;
+initial begin
+	sys_clk = 1'b0;
+	gpmc_clk = 1'b0;
+end
+always #5 sys_clk = ~sys_clk;
+always #6.5 gpmc_clk = ~gpmc_clk;
+
+/* GPMC host */
+reg [15:0] d_out;
+reg d_oe;
+wire [15:0] gpmc_d = d_oe ? d_out : 16'hzzzz;
+reg gpmc_we_n;
+reg gpmc_oe_n;
+reg gpmc_ale_n;
+reg gpmc_csr_cs_n;
+
+/*
+ * CSR slave with a read latency of 1: registers at 0-61, and a 32-bit
+ * register at 62 (most significant word) and 63, latched on csr_stb as
+ * AtomicRegister (tools/mmgr.py) does. Its value is a counter incremented
+ * at each sys_clk cycle, in both words, so that a read mixing two latches
+ * has different words.
+ */
+wire csr_stb;
+wire [13:0] csr_adr;
+wire csr_we;
+reg [15:0] csr_dat_r;
+wire [15:0] csr_dat_w;
+
+reg [15:0] regs[0:63];
+integer csr_reads;
+integer i;
+initial begin
+	for(i = 0; i < 64; i = i + 1)
+		regs[i] = {i[7:0], ~i[7:0]};
+	csr_reads = 0;
+end
+reg [15:0] counter;
+reg [31:0] latched;
+wire first = csr_stb & (csr_adr == 14'd62);
+initial counter = 16'd0;
+always @(posedge sys_clk) begin
+	counter <= counter + 16'd1;
+	if(first)
+		latched <= {counter, counter};
+	if(csr_we)
+		regs[csr_adr[5:0]] <= csr_dat_w;
+	case(csr_adr[5:0])
+		6'd62: csr_dat_r <= first ? counter : latched[31:16];
+		6'd63: csr_dat_r <= latched[15:0];
+		default: csr_dat_r <= regs[csr_adr[5:0]];
+	endcase
+	if(csr_stb & ~csr_we)
+		csr_reads = csr_reads + 1;
+end
+
+gpmc #(
+	.csr_burst(csr_burst),
+	.read_latency(read_latency),
+	.csr_read_latency(1)
+) dut (
+	.sys_clk(sys_clk),
+	.sys_rst(sys_rst),
+
+	.csr_stb(csr_stb),
+	.csr_adr(csr_adr),
+	.csr_we(csr_we),
+	.csr_dat_r(csr_dat_r),
+	.csr_dat_w(csr_dat_w),
+
+	.dma_dat_r(16'd0),
+
+	.gpmc_clk(gpmc_clk),
+	.gpmc_a(10'd0),
+	.gpmc_d(gpmc_d),
+	.gpmc_we_n(gpmc_we_n),
+	.gpmc_oe_n(gpmc_oe_n),
+	.gpmc_ale_n(gpmc_ale_n),
+	.gpmc_csr_cs_n(gpmc_csr_cs_n),
+	.gpmc_dma_cs_n(1'b1)
+);
+
+integer errors;
+
+/* address phase of one gpmc_clk cycle */
+task address_phase(input [13:0] adr);
+begin
+	@(negedge gpmc_clk);
+	gpmc_csr_cs_n = 1'b0;
+	gpmc_ale_n = 1'b0;
+	d_out = {2'd0, adr};
+	d_oe = 1'b1;
+	@(negedge gpmc_clk);
+	gpmc_ale_n = 1'b1;
+	d_oe = 1'b0;
+end
+endtask
+
+/* read n words from adr, sampling the first one read_latency cycles after
+ * asserting OE */
+task burst_read(input [13:0] adr, input integer n);
+	integer k;
+begin
+	address_phase(adr);
+	gpmc_oe_n = 1'b0;
+	repeat(read_latency - 1) @(posedge gpmc_clk);
+	for(k = 0; k < n; k = k + 1) begin
+		@(posedge gpmc_clk);
+		if(gpmc_d !== regs[adr + k]) begin
+			$display("read %d of %d at %h: %h, expected %h", k, n, adr, gpmc_d, regs[adr + k]);
+			errors = errors + 1;
+		end
+	end
+	@(negedge gpmc_clk);
+	gpmc_oe_n = 1'b1;
+	gpmc_csr_cs_n = 1'b1;
+end
+endtask
+
+/* write n words to adr, WE being asserted at the end of the address phase */
+task burst_write(input [13:0] adr, input integer n, input [15:0] first);
+	integer k;
+begin
+	@(negedge gpmc_clk);
+	gpmc_csr_cs_n = 1'b0;
+	gpmc_ale_n = 1'b0;
+	d_out = {2'd0, adr};
+	d_oe = 1'b1;
+	for(k = 0; k < n; k = k + 1) begin
+		@(negedge gpmc_clk);
+		gpmc_ale_n = 1'b1;
+		gpmc_we_n = 1'b0;
+		d_out = first + k;
+	end
+	@(negedge gpmc_clk);
+	gpmc_we_n = 1'b1;
+	gpmc_csr_cs_n = 1'b1;
+	d_oe = 1'b0;
+end
+endtask
+
+/* asynchronous read, sampled async_access cycles after asserting OE */
+task async_read(input [13:0] adr, output [15:0] value);
+begin
+	address_phase(adr);
+	gpmc_oe_n = 1'b0;
+	repeat(async_access) @(posedge gpmc_clk);
+	value = gpmc_d;
+	@(negedge gpmc_clk);
+	gpmc_oe_n = 1'b1;
+	gpmc_csr_cs_n = 1'b1;
+	repeat(4) @(negedge gpmc_clk);
+end
+endtask
+
+/* read the atomic register, one word after the other */
+reg [15:0] atomic_msw;
+reg [15:0] atomic_lsw;
+task atomic_read;
+begin
+	if(csr_burst) begin
+		address_phase(14'd62);
+		gpmc_oe_n = 1'b0;
+		repeat(read_latency) @(posedge gpmc_clk);
+		atomic_msw = gpmc_d;
+		@(posedge gpmc_clk);
+		atomic_lsw = gpmc_d;
+		@(negedge gpmc_clk);
+		gpmc_oe_n = 1'b1;
+		gpmc_csr_cs_n = 1'b1;
+	end else begin
+		async_read(14'd62, atomic_msw);
+		async_read(14'd63, atomic_lsw);
+	end
+	if(atomic_msw !== atomic_lsw) begin
+		$display("atomic read: %h %h", atomic_msw, atomic_lsw);
+		errors = errors + 1;
+	end
+end
+endtask
+
+integer reads_before;
+reg [15:0] previous;
+
+initial begin
+	errors = 0;
+	d_oe = 1'b0;
+	gpmc_we_n = 1'b1;
+	gpmc_oe_n = 1'b1;
+	gpmc_ale_n = 1'b1;
+	gpmc_csr_cs_n = 1'b1;
+	sys_rst = 1'b1;
+	repeat(4) @(posedge sys_clk);
+	sys_rst = 1'b0;
+	repeat(4) @(posedge gpmc_clk);
+
+	if(csr_burst) begin
+		/* short reads, back to back, each leaving most of its prefetch unread */
+		burst_read(14'd5, 1);
+		burst_read(14'd20, 3);
+		burst_read(14'd21, 2);
+		burst_read(14'd40, 1);
+		burst_read(14'd0, 16);
+		burst_read(14'd3, 1);
+
+		/* writes do not prefetch, and are read back */
+		repeat(40) @(posedge sys_clk);
+		reads_before = csr_reads;
+		burst_write(14'd8, 4, 16'hbe00);
+		repeat(40) @(posedge sys_clk);
+		if(csr_reads != reads_before) begin
+			$display("%d CSR reads during a write", csr_reads - reads_before);
+			errors = errors + 1;
+		end
+		burst_read(14'd8, 4);
+		burst_read(14'd9, 1);
+	end
+
+	/* each read of the atomic register gives a consistent, newer value */
+	previous = 16'd0;
+	for(i = 0; i < 8; i = i + 1) begin
+		atomic_read;
+		if(atomic_msw <= previous) begin
+			$display("atomic read %d: %h after %h", i, atomic_msw, previous);
+			errors = errors + 1;
+		end
+		previous = atomic_msw;
+	end
+
+	if(errors == 0)
+		$display("PASS");
+	else
+		$display("FAIL: %d errors", errors);
+	$finish;
+end
+
+endmodule
@@ -2,8 +2,10 @@ from math import sin, pi
 
 import matplotlib.pyplot as plt
 
+from migen.fhdl.structure import *
 from migen.bus.transactions import *
 from migen.bus import csr
+from migen.bank.description import *
 from migen.bank import csrgen
 from migen.flow.transactions import *
 from migen.flow.network import *
@@ -12,16 +14,40 @@ from migen.sim.generic import Simulator
 from migen.sim.icarus import Runner
 
 from library.waveform_generator import WaveformGenerator
+from tools.mmgr import AtomicRegister
 
 # The WaveformGenerator component gives an abstract list of registers.
 # This derived class implements it on a CSR bus.
+# Registers wider than a CSR word (AtomicRegister) are given to the bank as
+# their words. The Initiator has no access strobe, so their first word is
+# latched whenever it is addressed.
 class CSRWG(WaveformGenerator):
 	def __init__(self, address, depth, width, spc):
 		WaveformGenerator.__init__(self, depth, width, spc)
-		self.bank = csrgen.Bank(self.get_registers(), address)
+		registers = []
+		self.atomic_registers = []
+		nwords = 0
+		for register in self.get_registers():
+			if isinstance(register, AtomicRegister):
+				register.address = (address << 9) + nwords
+				register.stb = Signal(reset=1)
+				registers += register.words
+				self.atomic_registers.append(register)
+				nwords += len(register.words)
+			else:
+				if isinstance(register, RegisterRaw):
+					nbits = register.size
+				else:
+					nbits = sum([f.size for f in register.fields])
+				registers.append(register)
+				nwords += (csr.data_width - 1 + nbits)//csr.data_width
+		self.bank = csrgen.Bank(registers, address)
+		for register in self.atomic_registers:
+			register.bus = self.bank.interface
 	
 	def get_fragment(self):
-		return WaveformGenerator.get_fragment(self) + self.bank.get_fragment()
+		return WaveformGenerator.get_fragment(self) + self.bank.get_fragment() \
+			+ sum([r.get_fragment() for r in self.atomic_registers], Fragment())
 
 width = 16
 depth = 512
@@ -42,6 +68,8 @@ csr_data_in_l0 = 7
 csr_data_in_h1 = 8
 csr_data_in_l1 = 9
 csr_shift_data = 10
+csr_load_h = 11
+csr_load_l = 12
 
 def programmer(values, received_values):
 	# Go to "load waveform" mode
@@ -72,6 +100,19 @@ def programmer(values, received_values):
 	while len(received_values) < 4*depth:
 		yield None
 
+def load_programmer(values, received_values):
+	# Go to "load waveform" mode
+	yield TWrite(csr_mode, 1)
+	# Load the waveform one sample at a time
+	for v in values:
+		yield TWrite(csr_load_h, (v & 0xff00) >> 8)
+		yield TWrite(csr_load_l, v & 0x00ff)
+	
+	# Go to playback mode and collect a period
+	yield TWrite(csr_mode, 2)
+	while len(received_values) < depth:
+		yield None
+
 def receiver():
 	while True:
 		t = Token("sample")
@@ -81,7 +122,10 @@ def receiver():
 		received_values_i.append(t.value["i1"])
 		received_values_q.append(t.value["q1"])
 
-def main():
+def simulate(programmer):
+	del received_values_i[:]
+	del received_values_q[:]
+	
 	# Create a simple dataflow system
 	receiver_layout = [
 		("i0", width),
@@ -116,10 +160,16 @@ def main():
 	# Check correctness of the first received values
 	assert(received_values_i[:depth] == values_i)
 	assert(received_values_q[:depth] == values_q)
+	return list(received_values_i), list(received_values_q)
+
+def main():
+	# Load through data_inN and shift_data, then through load
+	plot_i, plot_q = simulate(programmer)
+	simulate(load_programmer)
 	
 	# Plot waveform
-	plt.plot(received_values_i)
-	plt.plot(received_values_q)
+	plt.plot(plot_i)
+	plt.plot(plot_q)
 	plt.show()
 
 main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import os, sys, argparse
+
+import tools
+import build
+from tools import timing, utilization, sweep
+
+def main():
+	tools.print_header()
+
+	parser = argparse.ArgumentParser(description="Build an application over a grid of component parameters "
+		"and report the configurations on the Pareto front of Fmax and area.")
+	parser.add_argument("-e", "--extension-dir", action="append", default=[os.getcwd()])
+	parser.add_argument("-p", "--platform", default="rhino")
+	parser.add_argument("-b", "--backend",
+		help="module of tools/ implementing the build (default: vendor of the platform)")
+	parser.add_argument("-j", "--jobs", type=int, default=1,
+		help="number of configurations to build in parallel")
+	parser.add_argument("--mem-per-job", type=int, default=3072,
+		help="memory (MB) reserved for each parallel job, caps the number of jobs")
+	parser.add_argument("--cache-dir", default=os.path.join(os.path.expanduser("~"), ".cache", "rhino-tools"),
+		help="directory of the build cache")
+	parser.add_argument("--no-cache", action="store_true",
+		help="always run the vendor tools")
+	parser.add_argument("--domain", default="sys",
+		help="clock domain whose Fmax is optimized")
+	parser.add_argument("--area", default="slices",
+		help="utilization total used as area (slices, luts, ffs, brams, dsp48s)")
+	parser.add_argument("application")
+	parser.add_argument("axes", nargs="+", metavar="component.param=v1,v2,...",
+		help="parameter values to sweep, the component is a component name or class name in lower case")
+	args = parser.parse_args()
+	search_dirs = list(map(os.path.abspath, reversed(args.extension_dir)))
+	build_name = args.application
+
+	root_dir, application_dir = tools.find_dir(search_dirs, os.path.join("application", build_name))
+	if application_dir is None:
+		raise IOError("Could not find application " + build_name)
+	build_dir = os.path.join(application_dir, "build")
+	tools.mkdir_noerror(build_dir)
+
+	points = sweep.expand([sweep.parse_axis(a) for a in args.axes])
+	library_hdl = build.find_library_hdl(search_dirs)
+	cache_dir = None if args.no_cache else args.cache_dir
+	jobs = min(build.max_jobs(args.jobs, args.mem_per_job), len(points))
+	outcome = build.build_parallel(search_dirs, args.platform, args.backend, library_hdl, cache_dir, dict(), None,
+		[(build_name, overrides, variant) for variant, overrides, params in points], jobs)
+	errors = dict((output, error) for output, log_file, error, duration in outcome)
+
+	results = []
+	for variant, overrides, params in points:
+		output = build.output_name(build_name, variant)
+		fmax = None
+		area = None
+		timing_file = os.path.join(build_dir, output + ".timing.json")
+		util_file = os.path.join(build_dir, output + ".util.json")
+		if errors.get(output) is None:
+			if os.path.exists(timing_file):
+				fmax = timing.read_report(timing_file).get(args.domain, {}).get("fmax")
+			if os.path.exists(util_file):
+				area = utilization.read_report(util_file)["total"].get(args.area)
+		results.append({"variant": variant, "params": params, "fmax": fmax, "area": area,
+			"error": errors.get(output)})
+	front = sweep.pareto_front(results)
+
+	print("")
+	sweep.print_summary(results, front, args.area)
+	sweep.write_report(os.path.join(build_dir, build_name + ".sweep.json"), results, front)
+	if not front:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
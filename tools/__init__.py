@@ -1,4 +1,4 @@
-import os, subprocess, shutil, imp
+import os, subprocess, shutil, imp, time
 
 def try_import(search_dirs, path, name):
 	search_dirs = [os.path.join(search_dir, path) for search_dir in search_dirs]
@@ -14,7 +14,7 @@ def find_dir(search_dirs, path):
 		full_dir = os.path.join(search_dir, path)
 		if os.path.isdir(full_dir):
 			return search_dir, full_dir
-	return None
+	return None, None
 
 def mkdir_noerror(d):
 	try:
@@ -22,6 +22,27 @@ def mkdir_noerror(d):
 	except OSError:
 		pass
 
+# Run a command and wait for it.
+# Returns the exit code, the wall time and the resource usage of the process
+# and its descendants.
+def call(args, **kwargs):
+	start = time.time()
+	p = subprocess.Popen(args, **kwargs)
+	pid, status, ru = os.wait4(p.pid, 0)
+	p.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+	return p.returncode, time.time() - start, ru
+
+# Package a bitstream and its symbol table into a BORPH object file
+def make_bof(hwrtyp, symtab_file, bin_file, bof_file, perf):
+	r, wall, ru = call(["mkbof",
+		"-t", str(hwrtyp),
+		"-s", symtab_file,
+		"-o", bof_file,
+		bin_file])
+	perf.add_process("mkbof", wall, ru)
+	if r != 0:
+		raise OSError("Subprocess failed")
+
 # Save a string to a file
 def write_to_file(filename, contents):
 	f = open(filename, "w")
@@ -0,0 +1,53 @@
+import os, shutil, hashlib, tempfile
+
+# Content-addressed store of build artifacts.
+# Each entry is a directory named after the hash of everything the
+# artifacts were built from.
+class BuildCache:
+	def __init__(self, directory):
+		self.directory = directory
+
+	def key(self, strings, files):
+		h = hashlib.sha256()
+		def add(data):
+			h.update(str(len(data)).encode() + b":")
+			h.update(data)
+		for s in strings:
+			add(s.encode())
+		contents = []
+		for path in files:
+			with open(path, "rb") as f:
+				contents.append((os.path.basename(path), f.read()))
+		for name, data in sorted(contents):
+			add(name.encode())
+			add(data)
+		return h.hexdigest()
+
+	# artifacts is a dictionary: name in cache -> path in build tree
+	# optional artifacts are copied when the entry has them
+	def fetch(self, key, artifacts, optional={}):
+		entry = os.path.join(self.directory, key)
+		if not all(os.path.isfile(os.path.join(entry, name)) for name in artifacts):
+			return False
+		for name, path in artifacts.items():
+			shutil.copyfile(os.path.join(entry, name), path)
+		for name, path in optional.items():
+			if os.path.isfile(os.path.join(entry, name)):
+				shutil.copyfile(os.path.join(entry, name), path)
+		return True
+
+	def store(self, key, artifacts):
+		entry = os.path.join(self.directory, key)
+		if os.path.isdir(entry):
+			return
+		os.makedirs(self.directory, exist_ok=True)
+		# Populate a temporary directory and rename it, so that concurrent
+		# builds never see a partial entry.
+		tmp = tempfile.mkdtemp(dir=self.directory)
+		for name, path in artifacts.items():
+			if os.path.isfile(path):
+				shutil.copyfile(path, os.path.join(tmp, name))
+		try:
+			os.rename(tmp, entry)
+		except OSError:
+			shutil.rmtree(tmp)
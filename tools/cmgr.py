@@ -25,12 +25,6 @@ class Subsignal:
 		self.name = name
 		self.constraints = list(constraints)
 
-def _lookup(description, name, number):
-	for resource in description:
-		if resource[0] == name and (number is None or resource[1] == number):
-			return resource
-	return ConstraintError("Resource not found")
-		
 def _resource_type(resource):
 	t = None
 	for element in resource[2:]:
@@ -49,22 +43,82 @@ def _resource_type(resource):
 			t.append((element.name, n_bits))
 	return t
 
-def _match(description, requests):
-	available = list(description)
+def _format_resource(name, number):
+	if number is None:
+		return name
+	return name + ":" + str(number)
+
+# Resources of a platform indexed by (name, number) and by name, with
+# their types computed once.
+class _ResourceIndex:
+	def __init__(self, description):
+		self.description = description
+		self.resources = dict()
+		self.by_name = dict()
+		self.types = dict()
+		for resource in description:
+			key = (resource[0], resource[1])
+			if key in self.resources:
+				raise ConstraintError("Resource %s is defined more than once" % _format_resource(*key))
+			self.resources[key] = resource
+			self.by_name.setdefault(resource[0], []).append(resource)
+			self.types[key] = _resource_type(resource)
+	
+	# With no number, the first resource of that name
+	def lookup(self, name, number):
+		if number is None:
+			try:
+				return self.by_name[name][0]
+			except KeyError:
+				pass
+		else:
+			try:
+				return self.resources[(name, number)]
+			except KeyError:
+				pass
+		raise ConstraintError("Resource %s not found" % _format_resource(name, number))
+	
+	def get_type(self, resource):
+		return self.types[(resource[0], resource[1])]
+
+# Platform descriptions are module-level lists, index each of them once
+_indices = dict()
+
+def _get_index(description):
+	index = _indices.get(id(description))
+	if index is None or index.description is not description:
+		index = _ResourceIndex(description)
+		_indices[id(description)] = index
+	return index
+
+def _match(index, requests):
+	used = set()
 	matched = []
 	
 	# 1. Match requests for a specific number
 	for request in requests:
 		if request[1] is not None:
-			resource = _lookup(available, request[0], request[1])
-			available.remove(resource)
+			resource = index.lookup(request[0], request[1])
+			key = (resource[0], resource[1])
+			if key in used:
+				raise ConstraintError("Resource %s requested more than once" % _format_resource(*key))
+			used.add(key)
 			matched.append((resource, request[2]))
-			
-	# 2. Match requests for no specific number
+	
+	# 2. Match requests for no specific number, each name has a pointer
+	# to its first resource that may be free
+	free = dict()
 	for request in requests:
 		if request[1] is None:
-			resource = _lookup(available, request[0], request[1])
-			available.remove(resource)
+			candidates = index.by_name.get(request[0], [])
+			i = free.get(request[0], 0)
+			while i < len(candidates) and (candidates[i][0], candidates[i][1]) in used:
+				i += 1
+			if i == len(candidates):
+				raise ConstraintError("No %s resource left" % request[0])
+			resource = candidates[i]
+			used.add((resource[0], resource[1]))
+			free[request[0]] = i + 1
 			matched.append((resource, request[2]))
 	
 	return matched
@@ -83,12 +137,26 @@ def _separate_pins(constraints):
 class ConstraintManager:
 	def __init__(self, description):
 		self.description = description
+		self.index = _get_index(description)
 		self.requests = []
 		self.platform_commands = []
+		# (name, number) of numbered requests, and number of requests by name
+		self.requested = set()
+		self.request_counts = dict()
 		
 	def request(self, name, number=None, obj=None):
-		r = _lookup(self.description, name, number)
-		t = _resource_type(r)
+		r = self.index.lookup(name, number)
+		t = self.index.get_type(r)
+		
+		# Report conflicts at the point of the request
+		if number is not None:
+			if (name, number) in self.requested:
+				raise ConstraintError("Resource %s requested more than once" % _format_resource(name, number))
+			self.requested.add((name, number))
+		count = self.request_counts.get(name, 0) + 1
+		if count > len(self.index.by_name[name]):
+			raise ConstraintError("No %s resource left" % name)
+		self.request_counts[name] = count
 		
 		# If obj is None, then create it.
 		# If it already exists, do some sanity checking.
@@ -128,7 +196,7 @@ class ConstraintManager:
 	
 	def get_sig_constraints(self):
 		r = []
-		matched = _match(self.description, self.requests)
+		matched = _match(self.index, self.requests)
 		for resource, obj in matched:
 			name = resource[0]
 			number = resource[1]
@@ -0,0 +1,124 @@
+import re, hashlib
+
+from migen.fhdl.structure import *
+from migen.fhdl.tools import list_signals, list_targets, list_inst_ios, list_mem_ios
+from migen.fhdl import verilog
+
+def _only_signals(s):
+	return set(e for e in s if isinstance(e, Signal))
+
+def _fragment_signals(f):
+	r = list_signals(f.comb)
+	for statements in f.sync.values():
+		r |= list_signals(statements)
+	r |= list_inst_ios(f, True, True, True)
+	r |= list_mem_ios(f, True, True)
+	return _only_signals(r)
+
+def _fragment_driven(f):
+	r = list_targets(f.comb)
+	for statements in f.sync.values():
+		r |= list_targets(statements)
+	r |= list_inst_ios(f, False, True, False)
+	r |= list_mem_ios(f, False, True)
+	return _only_signals(r)
+
+def _fragment_domains(f):
+	r = set(f.sync.keys())
+	for i in f.instances:
+		for item in i.items:
+			if isinstance(item, (Instance.ClockPort, Instance.ResetPort)):
+				r.add(item.domain)
+	for m in f.memories:
+		for p in m.ports:
+			r.add(p.clock_domain)
+	return r
+
+# Resolves names of signals of the top module first, then of the
+# submodules as hierarchical names (instance/signal).
+class HierarchicalNamespace:
+	def __init__(self, top, submodules):
+		self.top = top
+		self.submodules = submodules
+
+	def get_name(self, sig):
+		try:
+			return self.top.get_name(sig)
+		except KeyError:
+			pass
+		for instance_name, ns in self.submodules:
+			try:
+				return instance_name + "/" + ns.get_name(sig)
+			except KeyError:
+				pass
+		raise KeyError(sig)
+
+# Count the primitives instantiated by a fragment, by type
+def count_instances(f):
+	r = dict()
+	for i in f.instances:
+		r[i.of] = r.get(i.of, 0) + 1
+	return r
+
+# Give a module a name derived from its contents, so that identical
+# components (same class and parameters) share a module. The module name,
+# which contains the instance name, is left out of the hash.
+def _content_name(src, name, prefix):
+	header = re.compile(r"\bmodule " + name + r"\b")
+	digest = hashlib.sha1(header.sub("module " + prefix, src, count=1).encode()).hexdigest()[:10]
+	module_name = prefix + "_" + digest
+	return module_name, header.sub("module " + module_name, src, count=1)
+
+# Convert a design to Verilog, with each of the given fragments in a
+# module of its own.
+#   top: fragment of the logic remaining in the top module
+#   components: list of (instance name, fragment, module name prefix)
+#   ios: I/O signals of the top module
+#   reuse: name modules after their contents and leave them out of the
+#          returned source, so that they can be compiled separately and
+#          shared between instances and designs
+# Returns the Verilog source, a HierarchicalNamespace and the list of
+# (instance name, module name, module source).
+def convert(top, components, ios, clock_domains, name="top", reuse=False):
+	infos = []
+	for instance_name, f, prefix in components:
+		infos.append((instance_name, f, prefix, _fragment_signals(f), _fragment_driven(f)))
+	top_signals = _fragment_signals(top) | set(ios)
+
+	modules = []
+	instances = []
+	for instance_name, f, prefix, signals, driven in infos:
+		outside = set(top_signals)
+		for other_name, other_f, other_prefix, other_signals, other_driven in infos:
+			if other_f is not f:
+				outside |= other_signals
+		ports = signals & outside
+		for domain in _fragment_domains(f):
+			cd = clock_domains[domain]
+			ports |= set([cd.clk, cd.rst])
+		inouts = ports & _only_signals(list_inst_ios(f, False, False, True))
+		outputs = (ports & driven) - inouts
+		inputs = ports - outputs - inouts
+
+		module_name = name + "_" + instance_name
+		src, ns = verilog.convert(f, ports, name=module_name,
+			clock_domains=clock_domains, return_ns=True)
+		if reuse:
+			module_name, src = _content_name(src, module_name, prefix)
+		modules.append((instance_name, module_name, src, ns))
+
+		items = [Instance.Input(ns.get_name(s), s) for s in inputs] \
+			+ [Instance.Output(ns.get_name(s), s) for s in outputs] \
+			+ [Instance.InOut(ns.get_name(s), s) for s in inouts]
+		instances.append(Instance(module_name, *items, name=instance_name))
+
+	top_src, top_ns = verilog.convert(top + Fragment(instances=instances), ios,
+		name=name, clock_domains=clock_domains, return_ns=True)
+	ns = HierarchicalNamespace(top_ns, [(instance_name, module_ns)
+		for instance_name, module_name, src, module_ns in modules])
+	if reuse:
+		src = top_src
+	else:
+		src = "".join(src for instance_name, module_name, src, module_ns in modules) + top_src
+	return src, ns, [(instance_name, module_name, src)
+		for instance_name, module_name, src, module_ns in modules]
@@ -1,3 +1,7 @@
+from functools import reduce
+from operator import or_
+
+from migen.fhdl.structure import *
 from migen.bus import csr
 from migen.bank.description import *
 from migen.bank import csrgen
@@ -6,25 +10,256 @@ from library.uid import UID
 
 BOF_PERM_READ = 0x01
 BOF_PERM_WRITE = 0x02
+# Register accessed atomically (AtomicRegister), 32-bit aligned
+BOF_PERM_ATOMIC = 0x04
+
+# Offset of the bank number in CSR word addresses
+_BANK_SHIFT = 9
+_WINDOW_WORDS = 2**_BANK_SHIFT
+
+def _nwords(nbits):
+	return (csr.data_width - 1 + nbits)//csr.data_width
+
+def _register_nbits(register):
+	if isinstance(register, RegisterRaw):
+		return register.size
+	else:
+		return sum([f.size for f in register.fields])
+
+class _AtomicField:
+	def __init__(self, size, access_bus, access_dev, reset):
+		if access_bus != READ_ONLY or access_dev != WRITE_ONLY:
+			self.r = Signal(size, reset=reset)
+		if access_bus != READ_ONLY:
+			self.re = Signal()
+		if access_dev != READ_ONLY:
+			self.w = Signal(size)
+		if access_dev == READ_WRITE:
+			self.we = Signal()
 
+# A register wider than a CSR word that is accessed atomically.
+# Each access to the first (most significant) word latches the whole value,
+# the other words return the latched value. Words written before the last
+# one are held, the register is updated when the last word is written.
+# Accesses are signalled by the strobe of the CSR master (see CSRManager).
+# With the asynchronous GPMC bridge, the strobe reaches the banks later than
+# the address (see library/hdl/gpmc.v): reads of the first word need a
+# longer access time than other registers.
+# The device side is the same as that of a single field RegisterField
+# (field.r, field.w, field.we), and field.re pulses when field.r takes a
+# value written by the bus.
+class AtomicRegister:
+	def __init__(self, name, size, access_bus=READ_WRITE, access_dev=READ_ONLY, reset=0):
+		self.name = name
+		self.size = size
+		self.access_bus = access_bus
+		self.access_dev = access_dev
+		self.field = _AtomicField(size, access_bus, access_dev, reset)
+		self.words = [RegisterRaw(name + str(i), csr.data_width) for i in range(_nwords(size))]
+		# set by CSRManager
+		self.bus = None
+		self.stb = None
+		self.address = None
+	
+	def _word_slice(self, value, i):
+		lo = (len(self.words) - 1 - i)*csr.data_width
+		return value[lo:min(lo + csr.data_width, self.size)]
+	
+	def get_fragment(self):
+		n = len(self.words)
+		if hasattr(self.field, "r"):
+			live = self.field.r
+		else:
+			live = self.field.w
+		
+		# read latch
+		latched = Signal(self.size)
+		first = Signal()
+		comb = [first.eq(self.stb & (self.bus.adr == self.address))]
+		comb += [w.w.eq(self._word_slice(latched, i)) for i, w in enumerate(self.words)]
+		comb.append(If(first, self.words[0].w.eq(self._word_slice(live, 0))))
+		sync = [If(first, latched.eq(live))]
+		
+		# write shadow
+		if self.access_bus != READ_ONLY:
+			shadows = [Signal(csr.data_width) for i in range(n - 1)]
+			sync += [If(w.re, shadow.eq(w.r)) for w, shadow in zip(self.words, shadows)]
+			commit = If(self.words[-1].re,
+				self.field.r.eq(Cat(self.words[-1].r, *reversed(shadows)))
+			)
+			if self.access_dev == READ_WRITE:
+				commit = commit.Elif(self.field.we, self.field.r.eq(self.field.w))
+			sync += [commit, self.field.re.eq(self.words[-1].re)]
+		elif hasattr(self.field, "we"):
+			sync.append(If(self.field.we, self.field.r.eq(self.field.w)))
+		
+		return Fragment(comb, sync)
+
+# A RegisterField, or an AtomicRegister when it is wider than a CSR word
+def wide_register(name, size, access_bus=READ_WRITE, access_dev=READ_ONLY, reset=0):
+	if size > csr.data_width:
+		return AtomicRegister(name, size, access_bus, access_dev, reset)
+	else:
+		return RegisterField(name, size, access_bus, access_dev, reset)
+
+# A memory accessed through the window of a CSR bank. Entries wider than a
+# CSR word take a power of two number of words, most significant first.
+# Words written before the last one of an entry are held, the entry is
+# written with the last one. Memories with more entries than the window
+# are paged: the page register selects which entries the window shows.
+class CSRMemory:
+	def __init__(self, memory, address, page_name):
+		self.memory = memory
+		self.address = address
+		self.bus = csr.Interface()
+		self.nwords = _nwords(memory.width)
+		self.word_bits = bits_for(self.nwords - 1) if self.nwords > 1 else 0
+		# words of the window taken by the memory
+		self.window_words = min(memory.depth << self.word_bits, _WINDOW_WORDS)
+		entries = _WINDOW_WORDS >> self.word_bits
+		npages = (memory.depth + entries - 1)//entries
+		if npages > 1:
+			self.page = RegisterField(page_name, bits_for(npages - 1))
+		else:
+			self.page = None
+	
+	def get_registers(self):
+		if self.page is None:
+			return []
+		else:
+			return [self.page]
+	
+	def _word_slice(self, value, i):
+		lo = (self.nwords - 1 - i)*csr.data_width
+		return value[lo:min(lo + csr.data_width, self.memory.width)]
+	
+	def get_fragment(self):
+		port = self.memory.get_port(write_capable=True)
+		sel = Signal()
+		sel_r = Signal()
+		offset = self.bus.adr[:_BANK_SHIFT]
+		entry = offset[self.word_bits:]
+		comb = [sel.eq(self.bus.adr[_BANK_SHIFT:] == self.address)]
+		sync = [sel_r.eq(sel)]
+		if self.page is None:
+			comb.append(port.adr.eq(entry))
+		else:
+			comb.append(port.adr.eq(Cat(entry, self.page.field.r)))
+		if self.nwords == 1:
+			comb += [
+				port.we.eq(sel & self.bus.we),
+				port.dat_w.eq(self.bus.dat_w),
+				If(sel_r,
+					self.bus.dat_r.eq(port.dat_r)
+				)
+			]
+		else:
+			word = offset[:self.word_bits]
+			word_r = Signal(self.word_bits)
+			shadows = [Signal(csr.data_width) for i in range(self.nwords - 1)]
+			sync.append(word_r.eq(word))
+			sync += [If(sel & self.bus.we & (word == i), shadow.eq(self.bus.dat_w))
+				for i, shadow in enumerate(shadows)]
+			comb += [
+				port.we.eq(sel & self.bus.we & (word == self.nwords - 1)),
+				port.dat_w.eq(Cat(self.bus.dat_w, *reversed(shadows)))
+			]
+			comb += [If(sel_r & (word_r == i), self.bus.dat_r.eq(self._word_slice(port.dat_r, i)))
+				for i in range(self.nwords)]
+		return Fragment(comb, sync)
+
+# Connect slaves to master through levels of registers, each register
+# driving at most fanin slaves or subtrees. Slaves return 0 when not
+# addressed, so read data is OR-ed.
+def _csr_tree(master, slaves, levels, fanin):
+	if not levels:
+		comb = []
+		for slave in slaves:
+			comb += [
+				slave.adr.eq(master.adr),
+				slave.we.eq(master.we),
+				slave.dat_w.eq(master.dat_w)
+			]
+		comb.append(master.dat_r.eq(reduce(or_, [slave.dat_r for slave in slaves])))
+		return Fragment(comb)
+	
+	f = Fragment()
+	sync = []
+	children = []
+	group_size = (len(slaves) + fanin - 1)//fanin
+	for i in range(0, len(slaves), group_size):
+		child = csr.Interface()
+		sync += [
+			child.adr.eq(master.adr),
+			child.we.eq(master.we),
+			child.dat_w.eq(master.dat_w)
+		]
+		f += _csr_tree(child, slaves[i:i+group_size], levels - 1, fanin)
+		children.append(child)
+	sync.append(master.dat_r.eq(reduce(or_, [child.dat_r for child in children])))
+	return f + Fragment(sync=sync)
+
+# pipeline_depth: 0 connects all slots to the master through a flat
+# interconnect. Otherwise slots are connected through a tree with that
+# number of levels, each registering the address and write data on the way
+# down and the read data on the way up. Reads then take read_latency cycles.
+# master_stb must pulse at each access of the master, once its address is
+# valid (AtomicRegisters, including those of the UIDs, use it).
 class CSRManager:
-	def __init__(self):
+	def __init__(self, pipeline_depth=0):
 		self.slots = []
 		self.master = None
+		self.master_stb = None
+		self.pipeline_depth = pipeline_depth
+		self.read_latency = 1 + 2*pipeline_depth
+		# master_stb, aligned with the address seen by the banks
+		self.stb = Signal()
 	
+	# Memories are named <name>_mem in the symbol table, or <name>_mem<n>
+	# when there are several. The page register of a paged memory is
+	# <memory name>_page. The depth and width of the memories, which the
+	# symbol table does not give, are described by get_memory_map.
+	# AtomicRegisters of several words are aligned to 32 bits, None marks
+	# the padding words in the list of registers of the slot.
 	def request(self, name, uid, *registers, memories=[]):
 		uid_inst = UID(uid)
-		all_registers = uid_inst.get_registers() + list(registers)
-		
+		all_registers = []
+		bank_registers = []
+		atomic_registers = []
+		nwords = 0
 		start_addr = len(self.slots)
+		for register in uid_inst.get_registers() + list(registers):
+			if isinstance(register, AtomicRegister):
+				if nwords % 2 and len(register.words) > 1:
+					all_registers.append(None)
+					bank_registers.append(RegisterRaw("pad" + str(nwords), csr.data_width))
+					nwords += 1
+				register.address = (start_addr << _BANK_SHIFT) + nwords
+				bank_registers += register.words
+				atomic_registers.append(register)
+				nwords += len(register.words)
+			else:
+				bank_registers.append(register)
+				nwords += _nwords(_register_nbits(register))
+			all_registers.append(register)
+		
 		memory_slots = []
 		for offset, memory in enumerate(memories):
-			access = csr.SRAM(memory, start_addr + 1 + offset)
+			if len(memories) > 1:
+				memory_name = name + "_mem" + str(offset)
+			else:
+				memory_name = name + "_mem"
+			access = CSRMemory(memory, start_addr + 1 + offset,
+				memory_name[len(name) + 1:] + "_page")
 			all_registers += access.get_registers()
-			memory_slots.append((name, memory, [access]))
+			bank_registers += access.get_registers()
+			memory_slots.append((memory_name, memory, [access]))
 			
-		bank = csrgen.Bank(all_registers, start_addr)
-		self.slots.append((name, all_registers, [bank, uid_inst]))
+		bank = csrgen.Bank(bank_registers, start_addr)
+		for register in atomic_registers:
+			register.bus = bank.bus
+			register.stb = self.stb
+		self.slots.append((name, all_registers, [bank, uid_inst] + atomic_registers))
 		self.slots += memory_slots
 	
 	def get_fragment(self):
@@ -33,7 +268,15 @@ class CSRManager:
 		for address, (name, what, instances) in enumerate(self.slots):
 			csr_ifs.append(instances[0].bus)
 			csr_f = sum([i.get_fragment() for i in instances], csr_f)
-		assert(self.master is not None)
+		assert(self.master is not None and self.master_stb is not None)
+		stbs = [self.master_stb] + [Signal() for i in range(self.pipeline_depth)]
+		csr_f += Fragment([self.stb.eq(stbs[-1])],
+			[stb.eq(prev) for prev, stb in zip(stbs, stbs[1:])])
+		if self.pipeline_depth:
+			fanin = 2
+			while fanin**self.pipeline_depth < len(csr_ifs):
+				fanin += 1
+			return csr_f + _csr_tree(self.master, csr_ifs, self.pipeline_depth, fanin)
 		csr_ic = csr.Interconnect(self.master, csr_ifs)
 		return csr_f + csr_ic.get_fragment()
 	
@@ -41,28 +284,128 @@ class CSRManager:
 		symtab = []
 		for name, what, instances in self.slots:
 			if isinstance(what, Memory):
-				symtab.append((name + "_mem", BOF_PERM_READ|BOF_PERM_WRITE, base, min(what.depth, 0x400)))
+				permission = BOF_PERM_READ|BOF_PERM_WRITE
+				symtab.append((name, permission, base, 2*instances[0].window_words))
 			else:
 				offset = 0
 				for register in what:
+					if register is None:
+						offset += 2
+						continue
 					if isinstance(register, RegisterRaw):
 						permission = BOF_PERM_READ|BOF_PERM_WRITE
 					else:
 						permission = 0
-						for f in register.fields:
+						if isinstance(register, AtomicRegister):
+							fields = [register]
+							permission |= BOF_PERM_ATOMIC
+						else:
+							fields = register.fields
+						for f in fields:
 							if (f.access_bus == READ_ONLY) or (f.access_bus == READ_WRITE):
 								permission |= BOF_PERM_READ
 							if (f.access_bus == WRITE_ONLY) or (f.access_bus == READ_WRITE):
 								permission |= BOF_PERM_WRITE
-					if isinstance(register, RegisterRaw):
+					if isinstance(register, AtomicRegister):
 						nbits = register.size
 					else:
-						nbits = sum([f.size for f in register.fields])
-					length = 2*((csr.data_width - 1 + nbits)//csr.data_width)
+						nbits = _register_nbits(register)
+					length = 2*_nwords(nbits)
 					symtab.append((name + "_" + register.name, permission, base + offset, length))
 					offset += length
 			base += 0x400
 		return symtab
+	
+	# {memory name: {"depth", "width", "page": name of the page register or
+	# None}} for the memories of the symbol table
+	def get_memory_map(self):
+		memory_map = dict()
+		for name, what, instances in self.slots:
+			if isinstance(what, Memory):
+				if instances[0].page is None:
+					page = None
+				else:
+					page = name + "_page"
+				memory_map[name] = {"depth": what.depth, "width": what.width, "page": page}
+		return memory_map
+
+(EVENT_EDGE, EVENT_LEVEL) = range(2)
+
+# An edge event becomes pending on a rising edge of trigger (not on a
+# trigger that is already high when leaving reset) and stays pending until
+# cleared by the host. A level event is pending while trigger is high.
+# A trigger from another clock_domain is synchronized to sys with two
+# registers, so it must stay high for at least two sys cycles.
+class EventSource:
+	def __init__(self, name, trigger, mode=EVENT_EDGE, clock_domain="sys"):
+		self.name = name
+		self.trigger = trigger
+		self.mode = mode
+		self.clock_domain = clock_domain
+
+# Events of each component are reported in an ev_pending register, one bit
+# per event in the order they are requested. Writing 1 to a bit clears the
+# corresponding edge event. The irq signal is high while an event that has
+# its bit set in the ev_enable register of the component is pending.
+# A pending level event keeps irq high until its trigger falls, so enable
+# level events only while waiting for them (as host/events.py wait_events
+# does).
+class EventManager:
+	def __init__(self):
+		self.groups = []
+		self.irq = Signal()
+	
+	# Returns the registers to request with the other CSRs of the component
+	def request(self, *events):
+		assert(0 < len(events) <= csr.data_width)
+		pending = RegisterRaw("ev_pending", len(events))
+		enable = RegisterField("ev_enable", len(events))
+		self.groups.append((events, pending, enable))
+		return [pending, enable]
+	
+	def get_fragment(self):
+		comb = []
+		sync = []
+		irqs = []
+		for events, pending, enable in self.groups:
+			bits = []
+			for i, event in enumerate(events):
+				if event.clock_domain == "sys":
+					trigger = event.trigger
+				else:
+					trigger_0 = Signal()
+					trigger = Signal()
+					sync += [
+						trigger_0.eq(event.trigger),
+						trigger.eq(trigger_0)
+					]
+				if event.mode == EVENT_LEVEL:
+					bits.append(trigger)
+				else:
+					bit = Signal()
+					trigger_r = Signal(reset=1)
+					sync += [
+						trigger_r.eq(trigger),
+						If(trigger & ~trigger_r,
+							bit.eq(1)
+						).Elif(pending.re & pending.r[i],
+							bit.eq(0)
+						)
+					]
+					bits.append(bit)
+			status = Signal(len(events))
+			irq = Signal()
+			comb += [
+				status.eq(Cat(*bits)),
+				pending.w.eq(status),
+				irq.eq((status & enable.field.r) != 0)
+			]
+			irqs.append(irq)
+		if irqs:
+			comb.append(self.irq.eq(reduce(or_, irqs)))
+		else:
+			comb.append(self.irq.eq(0))
+		return Fragment(comb, sync)
 
 (FROM_EXT, TO_EXT) = range(2)
 
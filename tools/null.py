@@ -0,0 +1,25 @@
+import tools
+import tools.xilinx as _project
+from tools.perf import PerfRecorder
+
+# Backend that runs the whole flow up to the invocation of the vendor tools.
+# Project files are generated as for the Xilinx flow, the bitstream and the
+# BOF file are stand-ins. Useful to benchmark and test elaboration on
+# machines without the tools.
+
+def get_build_id(device, namespace, sig_constraints, platform_commands):
+	return "null\n" + device + "\n" + _project._build_ucf(namespace, sig_constraints, platform_commands)
+
+def build(device, sources, namespace, sig_constraints, platform_commands, build_name,
+  perf=None, **options):
+	if perf is None:
+		perf = PerfRecorder()
+	_project.write_project_files(device, sources, namespace, sig_constraints, platform_commands, build_name, perf,
+		options.get("keep_hierarchy", False), options.get("module_dir"))
+	tools.write_to_file(build_name + ".bin", "")
+
+def make_bof(hwrtyp, symtab_file, bin_file, bof_file, perf):
+	with perf.phase("mkbof"):
+		with open(symtab_file) as f:
+			symtab = f.read()
+		tools.write_to_file(bof_file, "# null backend, hwrtyp %d\n%s" % (hwrtyp, symtab))
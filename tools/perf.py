@@ -0,0 +1,42 @@
+import time, json, resource
+from contextlib import contextmanager
+
+def _cpu_time(ru):
+	return ru.ru_utime + ru.ru_stime
+
+# Records wall time, CPU time and peak RSS of the phases of a build.
+# Peak RSS is in bytes. For Python phases it is the high-water mark of the
+# build process at the end of the phase, for tools it is that of the tool.
+class PerfRecorder:
+	def __init__(self):
+		self.phases = []
+
+	def add(self, name, wall, cpu, peak_rss):
+		self.phases.append({"name": name, "wall": wall, "cpu": cpu, "peak_rss": peak_rss})
+
+	@contextmanager
+	def phase(self, name):
+		wall_start = time.time()
+		cpu_start = _cpu_time(resource.getrusage(resource.RUSAGE_SELF))
+		try:
+			yield
+		finally:
+			ru = resource.getrusage(resource.RUSAGE_SELF)
+			self.add(name, time.time() - wall_start, _cpu_time(ru) - cpu_start, ru.ru_maxrss*1024)
+
+	# For subprocesses, from the resource usage returned by tools.call
+	def add_process(self, name, wall, ru):
+		self.add(name, wall, _cpu_time(ru), ru.ru_maxrss*1024)
+
+	def write_json(self, filename, **info):
+		report = dict(info)
+		report["phases"] = self.phases
+		with open(filename, "w") as f:
+			json.dump(report, f, indent=1, sort_keys=True)
+
+	def print_summary(self):
+		print("  %-24s %10s %10s %10s" % ("Phase", "Wall (s)", "CPU (s)", "Peak RSS"))
+		for p in self.phases:
+			print("  %-24s %10.2f %10.2f %8dMB" % (p["name"], p["wall"], p["cpu"], p["peak_rss"]//(1024*1024)))
+		print("  %-24s %10.2f %10.2f" % ("Total",
+			sum(p["wall"] for p in self.phases), sum(p["cpu"] for p in self.phases)))
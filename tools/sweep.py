@@ -0,0 +1,62 @@
+import ast, json, itertools
+
+# "demoaffine.pipeline_depth=1,2,3" -> (("demoaffine", "pipeline_depth"), [1, 2, 3])
+# The component is a component name or class name in lower case (see
+# build.apply_overrides). Values are Python literals, anything else is
+# taken as a string.
+def parse_axis(s):
+	key, values = s.split("=", 1)
+	component, param = key.rsplit(".", 1)
+	r = []
+	for v in values.split(","):
+		try:
+			r.append(ast.literal_eval(v))
+		except (ValueError, SyntaxError):
+			r.append(v)
+	return (component, param), r
+
+# All points of the grid, as (variant name, overrides, {axis: value})
+def expand(axes):
+	points = []
+	keys = [key for key, values in axes]
+	for i, values in enumerate(itertools.product(*[values for key, values in axes])):
+		overrides = dict()
+		for (component, param), v in zip(keys, values):
+			overrides.setdefault(component, dict())[param] = v
+		params = dict(("%s.%s" % key, v) for key, v in zip(keys, values))
+		points.append(("sweep%d" % i, overrides, params))
+	return points
+
+# Points that no other point beats on both Fmax (higher) and area (lower).
+# Points without results are left out.
+def pareto_front(results):
+	valid = [r for r in results if r["fmax"] is not None and r["area"] is not None]
+	front = []
+	for r in valid:
+		dominated = False
+		for o in valid:
+			if o["fmax"] >= r["fmax"] and o["area"] <= r["area"] \
+			  and (o["fmax"] > r["fmax"] or o["area"] < r["area"]):
+				dominated = True
+				break
+		if not dominated:
+			front.append(r)
+	return sorted(front, key=lambda r: r["area"])
+
+def write_report(filename, results, front):
+	with open(filename, "w") as f:
+		json.dump({"points": results, "pareto": [r["variant"] for r in front]},
+			f, indent=1, sort_keys=True)
+
+def print_summary(results, front, area_key):
+	def fmt(v, f):
+		return "-" if v is None else f % v
+	names = sorted(set(name for r in results for name in r["params"]))
+	front_variants = set(r["variant"] for r in front)
+	print("  %-10s" % "Variant" + "".join(" %16s" % name for name in names) \
+		+ " %12s %10s" % ("Fmax (MHz)", area_key) + "  Pareto")
+	for r in results:
+		print("  %-10s" % r["variant"] + "".join(" %16s" % repr(r["params"][name]) for name in names) \
+			+ " %12s %10s" % (fmt(r["fmax"], "%.2f"), fmt(r["area"], "%d")) \
+			+ ("  *" if r["variant"] in front_variants else "") \
+			+ ("  " + r["error"] if r["error"] else ""))
@@ -0,0 +1,65 @@
+import json
+
+class TimingError(Exception):
+	pass
+
+# Group the per-TIMESPEC results of a backend by clock domain.
+# timespecs maps clock domain names to the name of the TIMESPEC covering
+# them. Results of TIMESPECs that belong to no domain are keyed by the
+# TIMESPEC name.
+def summarize(entries, timespecs):
+	domain_of = dict((ts, domain) for domain, ts in timespecs.items())
+	r = dict()
+	for e in entries:
+		key = domain_of.get(e["timespec"], e["timespec"])
+		s = r.setdefault(key, {"worst_slack": None, "min_period": None,
+			"fmax": None, "failing_endpoints": 0, "timespecs": []})
+		if e["worst_slack"] is not None and (s["worst_slack"] is None or e["worst_slack"] < s["worst_slack"]):
+			s["worst_slack"] = e["worst_slack"]
+		if e["best_achievable"] is not None and (s["min_period"] is None or e["best_achievable"] > s["min_period"]):
+			s["min_period"] = e["best_achievable"]
+		s["failing_endpoints"] += e["errors"]
+		s["timespecs"].append(e["timespec"])
+	for s in r.values():
+		if s["min_period"]:
+			s["fmax"] = 1000.0/s["min_period"]
+	return r
+
+def write_report(filename, summary):
+	with open(filename, "w") as f:
+		json.dump(summary, f, indent=1, sort_keys=True)
+
+def read_report(filename):
+	with open(filename) as f:
+		return json.load(f)
+
+def print_summary(summary):
+	def fmt(v, f):
+		return "-" if v is None else f % v
+	print("  %-20s %12s %12s %10s" % ("Clock domain", "Slack (ns)", "Fmax (MHz)", "Failing"))
+	for key in sorted(summary):
+		s = summary[key]
+		print("  %-20s %12s %12s %10d" % (key, fmt(s["worst_slack"], "%.3f"),
+			fmt(s["fmax"], "%.2f"), s["failing_endpoints"]))
+
+# Returns a list of problems found in a summary.
+# fail_on_errors: any failing endpoint is a problem
+# baseline: summary of a previous build. A slack that got worse by more than
+#           tolerance (ns) is a problem.
+def check(summary, fail_on_errors=False, baseline=None, tolerance=0.0):
+	problems = []
+	if fail_on_errors:
+		for key in sorted(summary):
+			if summary[key]["failing_endpoints"]:
+				problems.append("%s: %d failing endpoint(s)" % (key, summary[key]["failing_endpoints"]))
+	if baseline is not None:
+		for key in sorted(baseline):
+			slack = summary.get(key, {}).get("worst_slack")
+			ref = baseline[key]["worst_slack"]
+			if ref is None:
+				continue
+			if slack is None:
+				problems.append("%s: no timing result" % key)
+			elif slack < ref - tolerance:
+				problems.append("%s: worst slack %.3fns, baseline %.3fns" % (key, slack, ref))
+	return problems
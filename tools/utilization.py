@@ -0,0 +1,38 @@
+import json
+
+_COLUMNS = [("slices", "Slices"), ("luts", "LUTs"), ("ffs", "FFs"), ("brams", "BRAMs"),
+	("dsp48s", "DSP48s"), ("ioserdes", "IOSERDES")]
+
+_IOSERDES = ["OSERDES2", "ISERDES2"]
+
+# Combine the utilization report of a backend with the primitives counted
+# in each component's fragment.
+#   report: {"total": {...}, "modules": {instance name: {...}}}
+#   instance_counts: {instance name: {primitive: count}}, or None when the
+#                    design was not built with hierarchy
+def summarize(report, instance_counts):
+	r = {"total": dict(report["total"]), "components": dict()}
+	if instance_counts is not None:
+		for name, counts in instance_counts.items():
+			usage = dict(report["modules"].get(name, {}))
+			usage["ioserdes"] = sum(counts.get(p, 0) for p in _IOSERDES)
+			r["components"][name] = usage
+	if "ioserdes" not in r["total"] and "oserdes" in r["total"]:
+		r["total"]["ioserdes"] = r["total"]["oserdes"] + r["total"].get("iserdes", 0)
+	return r
+
+def write_report(filename, summary):
+	with open(filename, "w") as f:
+		json.dump(summary, f, indent=1, sort_keys=True)
+
+def read_report(filename):
+	with open(filename) as f:
+		return json.load(f)
+
+def print_summary(summary):
+	def row(name, usage):
+		return "  %-20s" % name + "".join(" %9s" % usage.get(key, "-") for key, title in _COLUMNS)
+	print("  %-20s" % "Component" + "".join(" %9s" % title for key, title in _COLUMNS))
+	for name in sorted(summary["components"]):
+		print(row(name, summary["components"][name]))
+	print(row("Total", summary["total"]))
@@ -1,16 +1,30 @@
 import os
 import tools
+import re
+import json
+import shlex
+import fcntl
+import shutil
+import hashlib
 import datetime
+import threading
 import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from decimal import *
 
 from tools.cmgr import *
+from tools.perf import PerfRecorder
 
 XILINX_INSTALL_PATH = '/opt/Xilinx'  # Path to the Xilinx installation
 XILINX_VERSION      = None           # Use a specific version
                                      # (If unavailable tool will autodetect and
                                      #  use latest installed version)
 XILINX_TOOLS_TYPE   = 32             # Use 32-bit or 64-bit version of tools
+XILINX_COST_TABLES  = None           # List of placer cost tables to explore
+                                     # (None: single map/par run)
+XILINX_PAR_JOBS     = None           # Maximum number of concurrent map/par
+                                     # runs (None: number of CPUs)
 
 def _format_constraint(c):
 	if isinstance(c, Pins):
@@ -45,26 +59,334 @@ def _build_ucf(ns, sig_constraints, platform_commands):
 	
 	return r
 
-#-----------------------------------------------------------------------------#
-# Build the project in the current working directory                          #
-#                                                                             #
-# Parameters:                                                                 #
-#   sources: A list of HDL source files. Each element of the list is a        #
-#            dictionary with the following keys:                              #
-#            'type': 'verliog' or 'vhdl'                                      #
-#            'path': relative path to the file (from current directory)       # 
-#   build_name: A string to be used as a prefix for all generated files       #   
-#   top: Top level HDL component (assumes same as build_name if not specified)#
-#-----------------------------------------------------------------------------#
-def build(device, sources, namespace, sig_constraints, platform_commands, build_name):
-	# Generate UCF
-	tools.write_to_file(build_name + ".ucf", _build_ucf(namespace, sig_constraints, platform_commands))
+def _find_tools_version():
+	def isValidVersion(v):
+		try: 
+			Decimal(v)
+			return os.path.isdir(os.path.join(XILINX_INSTALL_PATH, v))
+		except:
+			return False
+	vers = [ver for ver in os.listdir(XILINX_INSTALL_PATH) if isValidVersion(ver)]
+	return str(XILINX_VERSION) in vers and str(XILINX_VERSION) or max(vers)
 
-	# Generate project file
+# Everything besides the HDL sources that determines the bitstream,
+# used as part of the build cache key
+def get_build_id(device, namespace, sig_constraints, platform_commands):
+	return "\n".join([device, _find_tools_version(), str(XILINX_TOOLS_TYPE),
+		_build_ucf(namespace, sig_constraints, platform_commands)])
+
+# A step of the implementation flow.
+# The stage is skipped when all its outputs exist and the stamp file
+# written after its last successful run matches the current command and
+# contents of its inputs.
+# The command runs in directory, relative to which inputs and outputs are
+# given.
+class _Stage:
+	def __init__(self, name, command, inputs, outputs, directory="."):
+		self.name = name
+		self.command = command
+		self.inputs = inputs
+		self.outputs = outputs
+		self.directory = directory
+
+	def key(self):
+		h = hashlib.sha256()
+		h.update(" ".join(self.command).encode())
+		for path in self.inputs:
+			h.update(path.encode())
+			with open(os.path.join(self.directory, path), "rb") as f:
+				for block in iter(lambda: f.read(1 << 20), b""):
+					h.update(block)
+		return h.hexdigest()
+
+	def up_to_date(self, stamp_file):
+		if not all(os.path.exists(os.path.join(self.directory, o)) for o in self.outputs):
+			return False
+		try:
+			with open(stamp_file) as f:
+				return f.read() == self.key()
+		except IOError:
+			return False
+
+_status_lock = threading.Lock()
+
+def _record_status(build_name, stage_name, record):
+	status_file = build_name + ".stages.json"
+	with _status_lock:
+		try:
+			with open(status_file) as f:
+				status = json.load(f)
+		except (IOError, ValueError):
+			status = dict()
+		status[stage_name] = record
+		with open(status_file, "w") as f:
+			json.dump(status, f, indent=1, sort_keys=True)
+
+# Run each stage with its own log (<build_name>.<stage>.log, in the
+# directory of the stage).
+# Exit codes are recorded in <build_name>.stages.json.
+def _run_stages(stages, settings_file, build_name, perf):
+	for stage in stages:
+		stamp_file = os.path.join(stage.directory, "%s.%s.stamp" % (build_name, stage.name))
+		log_file = os.path.join(stage.directory, "%s.%s.log" % (build_name, stage.name))
+		if stage.up_to_date(stamp_file):
+			print("  %-10s up to date" % stage.name)
+			continue
+		print("  %-10s running (log: %s)" % (stage.name, log_file))
+		if os.path.exists(stamp_file):
+			os.remove(stamp_file)
+		with open(log_file, "w") as log:
+			r, wall, ru = tools.call(["bash", "-c",
+				"source %s > /dev/null && exec %s" % (shlex.quote(settings_file),
+					" ".join(shlex.quote(a) for a in stage.command))],
+				stdout=log, stderr=subprocess.STDOUT, cwd=stage.directory)
+		perf.add_process(stage.name, wall, ru)
+		_record_status(build_name, stage.name,
+			{"exit_code": r, "log": log_file, "time": str(datetime.datetime.now())})
+		if r != 0:
+			raise OSError("Stage %s failed with exit code %d, see %s" % (stage.name, r, log_file))
+		tools.write_to_file(stamp_file, stage.key())
+
+# Directory of the map/par run with a cost table. ISE writes files with
+# fixed names (_xmsgs, xlnx_auto_0_xdb, usage statistics...) in the
+# current directory, so concurrent runs each have their own.
+def _cost_table_dir(cost_table):
+	return "ct_%d" % cost_table
+
+# Make path available in directory, as a symbolic link or else a copy
+def _link_input(path, directory):
+	target = os.path.join(directory, os.path.basename(path))
+	if os.path.islink(target):
+		return
+	try:
+		os.symlink(os.path.relpath(path, directory), target)
+	except OSError:
+		shutil.copyfile(path, target)
+
+def _map_par_stages(build_name, cost_table=None, detail=False):
+	if cost_table is None:
+		suffix = ""
+		t = []
+		directory = "."
+	else:
+		suffix = "_t%d" % cost_table
+		t = ["-t", str(cost_table)]
+		directory = _cost_table_dir(cost_table)
+	return [
+		_Stage("map" + suffix, ["map", "-ol", "high", "-w"] + (["-detail"] if detail else []) + t + [
+				"-o", build_name + ".ncd",
+				build_name + ".ngd", build_name + ".pcf"],
+			[build_name + ".ngd"],
+			[build_name + ".ncd", build_name + ".pcf", build_name + ".mrp"], directory),
+		_Stage("par" + suffix, ["par", "-ol", "high", "-w"] + t + [build_name + ".ncd",
+				build_name + "-routed.ncd", build_name + ".pcf"],
+			[build_name + ".ncd", build_name + ".pcf"],
+			[build_name + "-routed.ncd", build_name + "-routed.par"], directory)
+	]
+
+_timing_score_re = re.compile(r"^\s*Timing Score:\s*(\d+)", re.MULTILINE)
+
+# Timing score of a PAR report, 0 when all constraints are met.
+# None if the report does not give one.
+def parse_timing_score(par_file):
+	try:
+		with open(par_file) as f:
+			m = _timing_score_re.findall(f.read())
+	except IOError:
+		return None
+	if not m:
+		return None
+	return int(m[-1])
+
+def _parse_ns(s):
+	s = s.strip()
+	if not s.endswith("ns"):
+		return None
+	try:
+		return float(s[:-2])
+	except ValueError:
+		return None
+
+# Parse the constraint table of a PAR report.
+# Returns one entry per TIMESPEC with the worst slack and best achievable
+# period over all checks (in ns), the number of timing errors and the
+# timing score.
+def parse_timing_constraints(par_file):
+	with open(par_file) as f:
+		lines = f.read().splitlines()
+	start = None
+	for i, line in enumerate(lines):
+		if line.strip().startswith("Constraint") and "|" in line and "Check" in line:
+			start = i
+			break
+	if start is None:
+		return []
+
+	entries = []
+	group = []
+	def flush():
+		if not group:
+			return
+		text = " ".join("".join(row[0][2:-1] for row in group).split())
+		entry = {"timespec": text.split(" ")[0], "constraint": text,
+			"worst_slack": None, "best_achievable": None, "errors": 0, "score": 0}
+		for row in group:
+			if len(row) < 6 or not row[1].strip():
+				continue
+			slack = _parse_ns(row[2])
+			achievable = _parse_ns(row[3])
+			if slack is not None and (entry["worst_slack"] is None or slack < entry["worst_slack"]):
+				entry["worst_slack"] = slack
+			if achievable is not None and (entry["best_achievable"] is None or achievable > entry["best_achievable"]):
+				entry["best_achievable"] = achievable
+			try:
+				entry["errors"] += int(row[4])
+				entry["score"] += int(row[5])
+			except ValueError:
+				pass
+		entries.append(entry)
+		del group[:]
+
+	# skip the second header line and the separator below it
+	for line in lines[start+3:]:
+		if line.startswith("-----"):
+			flush()
+		elif "|" in line:
+			group.append(line.split("|"))
+		elif not line.strip():
+			flush()
+			break
+	flush()
+	return entries
+
+# Per-TIMESPEC timing results of the routed design
+def get_timing_report(build_name):
+	return parse_timing_constraints(build_name + "-routed.par")
+
+_UTILIZATION_COLUMNS = {
+	"Slices*": "slices",
+	"Slice Reg": "ffs",
+	"LUTs": "luts",
+	"BRAM/FIFO": "brams",
+	"DSP48A1": "dsp48s"
+}
+
+_UTILIZATION_TOTALS = [
+	("slices", "Number of occupied Slices"),
+	("ffs", "Number of Slice Registers"),
+	("luts", "Number of Slice LUTs"),
+	("brams", "Number of RAMB16BWERs"),
+	("brams8", "Number of RAMB8BWERs"),
+	("dsp48s", "Number of DSP48A1s"),
+	("oserdes", "Number of OLOGIC2/OSERDES2s"),
+	("iserdes", "Number of ILOGIC2/ISERDES2s")
+]
+
+def _parse_count(s):
+	return int(s.strip().replace(",", ""))
+
+# Parse the map report.
+# Returns chip totals and, when map ran with -detail on a design with
+# hierarchy, the utilization of each module instance (including its
+# children) keyed by its hierarchical name without the top module.
+def parse_utilization(mrp_file):
+	with open(mrp_file) as f:
+		lines = f.read().splitlines()
+
+	totals = dict()
+	for line in lines:
+		for key, label in _UTILIZATION_TOTALS:
+			if line.strip().startswith(label + ":") and key not in totals:
+				m = re.search(r":\s*([\d,]+)", line)
+				if m:
+					totals[key] = _parse_count(m.group(1))
+
+	modules = dict()
+	header = None
+	for line in lines:
+		if not line.startswith("|"):
+			continue
+		cells = [c.strip() for c in line.strip().strip("|").split("|")]
+		if cells[0] == "Module":
+			header = cells
+			continue
+		if header is None or len(cells) != len(header):
+			continue
+		row = dict(zip(header, cells))
+		path = row.get("Full Hierarchy", "").split("/")
+		if len(path) < 2:
+			continue
+		usage = dict()
+		for column, key in _UTILIZATION_COLUMNS.items():
+			if column in row:
+				try:
+					usage[key] = _parse_count(row[column].split("/")[-1])
+				except ValueError:
+					pass
+		modules["/".join(path[1:])] = usage
+	return {"total": totals, "modules": modules}
+
+def get_utilization_report(build_name):
+	return parse_utilization(build_name + ".mrp")
+
+# Run map and par with each placer cost table in parallel, each in its own
+# directory (ct_<cost table>), then copy the result with the best timing
+# score back for bitgen.
+def _explore_cost_tables(cost_tables, settings_file, build_name, perf, detail):
+	def run(cost_table):
+		directory = _cost_table_dir(cost_table)
+		try:
+			tools.mkdir_noerror(directory)
+			_link_input(build_name + ".ngd", directory)
+			_run_stages(_map_par_stages(build_name, cost_table, detail), settings_file, build_name, perf)
+		except (OSError, IOError) as e:
+			return cost_table, None, str(e)
+		return cost_table, parse_timing_score(os.path.join(directory, build_name + "-routed.par")), None
+
+	jobs = XILINX_PAR_JOBS or multiprocessing.cpu_count()
+	with ThreadPoolExecutor(max_workers=min(jobs, len(cost_tables))) as executor:
+		results = list(executor.map(run, cost_tables))
+
+	print("  Cost table exploration:")
+	print("   %-10s %-12s" % ("Cost table", "Timing score"))
+	for cost_table, score, error in results:
+		print("   %-10d %s" % (cost_table, error or ("unknown" if score is None else score)))
+	with open(build_name + ".cost_tables.json", "w") as f:
+		json.dump([{"cost_table": cost_table, "timing_score": score, "error": error}
+			for cost_table, score, error in results], f, indent=1)
+
+	candidates = [(score, cost_table) for cost_table, score, error in results
+		if error is None and score is not None]
+	if not candidates:
+		raise OSError("No successful place and route run")
+	score, best = min(candidates)
+	print("  Selected cost table %d (timing score %d)" % (best, score))
+	for ext in ["-routed.ncd", "-routed.par", ".pcf", ".mrp"]:
+		shutil.copyfile(os.path.join(_cost_table_dir(best), build_name + ext), build_name + ext)
+
+def _write_prj(filename, sources):
 	prj_contents = ""
 	for s in sources:
 		prj_contents += s["type"] + " work " + s["path"] + "\n"
-	tools.write_to_file(build_name + ".prj", prj_contents)
+	tools.write_to_file(filename, prj_contents)
+
+# Directory of the netlists of separately synthesized modules
+def _netlist_dir(module_dir, device):
+	return os.path.join(module_dir, device)
+
+# Write the UCF, project file and XST script
+# With module_dir, the sources that have a 'module' key are left out of the
+# project: XST reads their netlists from module_dir as black boxes.
+def write_project_files(device, sources, namespace, sig_constraints, platform_commands, build_name, perf,
+  keep_hierarchy=False, module_dir=None):
+	# Generate UCF
+	with perf.phase("ucf"):
+		tools.write_to_file(build_name + ".ucf", _build_ucf(namespace, sig_constraints, platform_commands))
+
+	# Generate project file
+	if module_dir is not None:
+		sources = [s for s in sources if "module" not in s]
+	_write_prj(build_name + ".prj", sources)
 
 	# Generate XST script
 	xst_contents = """run
@@ -73,42 +395,107 @@ def build(device, sources, namespace, sig_constraints, platform_commands, build_
 -ifmt MIXED
 -opt_mode SPEED
 -reduce_control_sets auto
+-keep_hierarchy %s
 -ofn %s.ngc
--p %s""" % (build_name, build_name, device)
+-p %s""" % (build_name, "soft" if keep_hierarchy else "no", build_name, device)
+	if module_dir is not None:
+		xst_contents += "\n-sd {%s}\n-read_cores optimize" % _netlist_dir(module_dir, device)
 	tools.write_to_file(build_name + ".xst", xst_contents)
 
+# Synthesize each module of the given sources on its own into
+# <module_dir>/<device>/<module>.ngc, without I/O buffers.
+# Modules are named after their contents, so a netlist is shared by all
+# the applications using the module and is only synthesized again when
+# the tools, device or non-generated HDL sources change. Builds running in
+# parallel serialize on a lock file per module.
+def _synthesize_modules(device, sources, module_dir, settings_file, perf):
+	netlist_dir = _netlist_dir(module_dir, device)
+	tools.mkdir_noerror(netlist_dir)
+	hdl = [s for s in sources if "module" not in s and not s.get("generated", False)]
+	for s in sources:
+		if "module" not in s:
+			continue
+		base = os.path.join(netlist_dir, s["module"])
+		with open(base + ".lock", "w") as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			_write_prj(base + ".prj", [s] + hdl)
+			tools.write_to_file(base + ".xst", """run
+-ifn %s.prj
+-top %s
+-ifmt MIXED
+-opt_mode SPEED
+-reduce_control_sets auto
+-iobuf NO
+-ofn %s.ngc
+-p %s""" % (base, s["module"], base, device))
+			print("  %s:" % s["module"])
+			stage = _Stage("xst", ["xst", "-ifn", base + ".xst"],
+				[base + ".xst", base + ".prj"] + [h["path"] for h in [s] + hdl],
+				[base + ".ngc"])
+			_run_stages([stage], settings_file, base, perf)
+
+#-----------------------------------------------------------------------------#
+# Build the project in the current working directory                          #
+#                                                                             #
+# Parameters:                                                                 #
+#   sources: A list of HDL source files. Each element of the list is a        #
+#            dictionary with the following keys:                              #
+#            'type': 'verliog' or 'vhdl'                                      #
+#            'path': relative path to the file (from current directory)       # 
+#            'module': (optional) name of the module defined by the file,     #
+#                      synthesized separately when module_dir is given        #
+#            'generated': (optional) True for the generated top level         #
+#   build_name: A string to be used as a prefix for all generated files       #   
+#   cost_tables: List of placer cost tables to run map/par with in parallel,  #
+#            keeping the best result (defaults to XILINX_COST_TABLES)         #
+#   perf: PerfRecorder receiving the timing of UCF generation and each tool   #
+#   keep_hierarchy: Keep the module hierarchy for per-module utilization      #
+#   module_dir: Directory of the netlists of separately synthesized modules,  #
+#            shared between applications                                      #
+#   top: Top level HDL component (assumes same as build_name if not specified)#
+#-----------------------------------------------------------------------------#
+def build(device, sources, namespace, sig_constraints, platform_commands, build_name,
+  cost_tables=None, perf=None, keep_hierarchy=False, module_dir=None):
+	if perf is None:
+		perf = PerfRecorder()
+
+	write_project_files(device, sources, namespace, sig_constraints, platform_commands, build_name, perf,
+		keep_hierarchy, module_dir)
+
 	# Determine Xilinx tool paths
-	def isValidVersion(v):
-		try: 
-			Decimal(v)
-			return os.path.isdir(os.path.join(XILINX_INSTALL_PATH, v))
-		except:
-			return False
-	vers = [ver for ver in os.listdir(XILINX_INSTALL_PATH) if isValidVersion(ver)]
-	tools_version = str(XILINX_VERSION) in vers and str(XILINX_VERSION) or max(vers)
-	xilinx_settings_file = '%s/%s/ISE_DS/settings%d.sh' % (XILINX_INSTALL_PATH, tools_version, XILINX_TOOLS_TYPE) 
-
-	# Generate Build script
-	build_script_contents = """# Build Script for %s
-# Autogenerated by rhino-tools at %s
-
-set -e
-
-source %s
-# XST
-xst -ifn %s.xst
-# NGD
-ngdbuild -uc %s.ucf %s.ngc
-# Mapping
-map -ol high -w %s.ngd
-# Place and Route
-par -ol high -w %s.ncd %s-routed.ncd
-# Generate FPGA configuration
-bitgen -g Binary:Yes -w %s-routed.ncd %s.bit
-""" % (build_name, datetime.datetime.now(), xilinx_settings_file, build_name, build_name, build_name, build_name, build_name, build_name, build_name, build_name)
-	build_script_file = "build_" + build_name + ".sh"
-	tools.write_to_file(build_script_file, build_script_contents)
-
-	r = subprocess.call(["bash", build_script_file])
-	if r != 0:
-		raise OSError("Subprocess failed")
+	xilinx_settings_file = '%s/%s/ISE_DS/settings%d.sh' % (XILINX_INSTALL_PATH, _find_tools_version(), XILINX_TOOLS_TYPE) 
+
+	# Implementation flow
+	# The UCF is an input of NGDBuild only, so a constraint change restarts
+	# the flow there.
+	if module_dir is not None:
+		_synthesize_modules(device, sources, module_dir, xilinx_settings_file, perf)
+		netlists = [os.path.join(_netlist_dir(module_dir, device), s["module"] + ".ngc")
+			for s in sources if "module" in s]
+		sd = ["-sd", _netlist_dir(module_dir, device)]
+	else:
+		netlists = []
+		sd = []
+	stages = [
+		_Stage("xst", ["xst", "-ifn", build_name + ".xst"],
+			[build_name + ".xst", build_name + ".prj"] + [s["path"] for s in sources] + netlists,
+			[build_name + ".ngc"]),
+		_Stage("ngdbuild", ["ngdbuild"] + sd + ["-uc", build_name + ".ucf", build_name + ".ngc"],
+			[build_name + ".ucf", build_name + ".ngc"] + netlists,
+			[build_name + ".ngd"])
+	]
+	_run_stages(stages, xilinx_settings_file, build_name, perf)
+
+	if cost_tables is None:
+		cost_tables = XILINX_COST_TABLES
+	if cost_tables:
+		_explore_cost_tables(list(cost_tables), xilinx_settings_file, build_name, perf, keep_hierarchy)
+	else:
+		_run_stages(_map_par_stages(build_name, detail=keep_hierarchy), xilinx_settings_file, build_name, perf)
+
+	stages = [
+		_Stage("bitgen", ["bitgen", "-g", "Binary:Yes", "-w", build_name + "-routed.ncd", build_name + ".bit"],
+			[build_name + "-routed.ncd"],
+			[build_name + ".bit", build_name + ".bin"])
+	]
+	_run_stages(stages, xilinx_settings_file, build_name, perf)